@@ -5,8 +5,15 @@
 #
 
 from .version import __version__
-from .split import split_qrs
-from .join import join_qrs
+from .split import split_qrs, split_qrs_iter, plan_split
+from .join import join_qrs, BBQrJoiner, BBQrPart, parse_part
+
+def __getattr__(name):
+    # batch functions need process pools; only import those when asked for
+    if name in ('split_many', 'join_many'):
+        from . import batch
+        return getattr(batch, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 
@@ -0,0 +1,76 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - asyncio version of joining: for servers handling many scanners at once
+# - parts come from an async iterator, or are pushed in with put()
+# - final decode/decompress runs in an executor, so a huge series
+#   doesn't stall the event loop for everyone else
+#
+import asyncio
+from .join import BBQrJoiner
+
+class ScanSession:
+    # One series being scanned. Start it, then await the result.
+    # - idle_timeout: seconds to wait for each part, before giving up (TimeoutError)
+    # - executor: for decode step; None means the loop's default (threads)
+    # - max_pending: put() waits when this many parts are queued but not processed
+
+    def __init__(self, idle_timeout=None, executor=None, max_pending=16):
+        self.idle_timeout = idle_timeout
+        self.executor = executor
+        self.joiner = BBQrJoiner(defer=True)
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.task = None
+
+    def start(self, parts=None):
+        # Begin consuming parts (async iterator of str), or from our own queue
+        # if not given. Returns a task which resolves to (file_type, raw).
+        if parts is None:
+            parts = self._drain()
+        self.task = asyncio.get_running_loop().create_task(self.consume(parts))
+        return self.task
+
+    async def consume(self, parts):
+        # Read parts until the series is complete, then decode off-loop.
+        it = parts.__aiter__()
+        while 1:
+            try:
+                part = await asyncio.wait_for(it.__anext__(), self.idle_timeout)
+            except StopAsyncIteration:
+                raise EOFError(f'ended with parts missing: {self.joiner.missing!r}')
+
+            self.joiner.add(part)
+
+            if self.joiner.have_all:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, self.joiner.decode)
+
+    async def put(self, part):
+        # provide next scanned part; waits if too many are already queued
+        await self.queue.put(part)
+
+    async def close(self):
+        # no more parts will be put()
+        await self.queue.put(None)
+
+    async def _drain(self):
+        while 1:
+            part = await self.queue.get()
+            if part is None:
+                break
+            yield part
+
+    def cancel(self):
+        # abandon this session
+        if self.task:
+            self.task.cancel()
+
+    @property
+    def progress(self):
+        return self.joiner.progress
+
+async def join_async(parts, idle_timeout=None, executor=None):
+    # Join parts from an async iterator: returns (file_type, raw)
+    return await ScanSession(idle_timeout, executor).start(parts)
+
+# EOF
@@ -0,0 +1,139 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - Base32 (RFC 4648 alphabet, no padding) using numpy: whole arrays of
+#   5-byte/8-char blocks at once, instead of a Python loop per block
+# - same results and errors as base64.b32encode/b32decode, which are
+#   used instead when numpy isn't installed (see utils.py)
+#
+import numpy as np
+from binascii import Error as B32Error
+
+ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+
+_ENC = np.frombuffer(ALPHABET, dtype=np.uint8)
+_DEC = np.full(256, 255, dtype=np.uint8)
+_DEC[_ENC] = np.arange(32, dtype=np.uint8)
+
+# chars in a partial final block => bytes it holds; other counts are never valid
+_TAIL_BYTES = {0: 0, 2: 1, 4: 2, 5: 3, 7: 4}
+
+# blocks per numpy step, to bound size of temporaries
+_CHUNK = 0x10000
+
+def _blocks(raw, nblocks):
+    # raw bytes as (nblocks, 5) array, zero padded at end
+    a = np.frombuffer(raw, dtype=np.uint8)
+    if len(a) == nblocks * 5:
+        return a.reshape(nblocks, 5)
+
+    rv = np.zeros(nblocks * 5, dtype=np.uint8)
+    rv[0:len(a)] = a
+    return rv.reshape(nblocks, 5)
+
+def encode_blocks(b, out):
+    # encode (..., 5) bytes into (..., 8) chars; out can be a view into something larger
+    for pos in range(0, len(b), _CHUNK):
+        b0, b1, b2, b3, b4 = np.moveaxis(b[pos:pos+_CHUNK], -1, 0)
+        o = out[pos:pos+_CHUNK]
+
+        o[..., 0] = _ENC[b0 >> 3]
+        o[..., 1] = _ENC[((b0 & 7) << 2) | (b1 >> 6)]
+        o[..., 2] = _ENC[(b1 >> 1) & 31]
+        o[..., 3] = _ENC[((b1 & 1) << 4) | (b2 >> 4)]
+        o[..., 4] = _ENC[((b2 & 15) << 1) | (b3 >> 7)]
+        o[..., 5] = _ENC[(b3 >> 2) & 31]
+        o[..., 6] = _ENC[((b3 & 3) << 3) | (b4 >> 5)]
+        o[..., 7] = _ENC[b4 & 31]
+
+def encode(raw):
+    # base32 text for bytes, without padding
+    n = len(raw)
+    nblocks = (n + 4) // 5
+    out = np.empty((nblocks, 8), dtype=np.uint8)
+    encode_blocks(_blocks(raw, nblocks), out)
+
+    # decode straight from array memory: no intermediate bytes copies
+    return str(memoryview(out.reshape(-1))[0:(n * 8 + 4) // 5], 'ascii')
+
+def encode_parts(raw, headers, per_each):
+    # base32 text for bytes, already split up as QR parts: each of the headers,
+    # followed by the next per_each chars (last part may be short)
+    # - encoded straight into one array laid out like the parts, so each part
+    #   string is a single copy out of that; no long string to slice up
+    # - per_each must be a multiple of 8, if more than one part
+    n = len(raw)
+    count = len(headers)
+    hl = len(headers[0])
+    nchars = (n * 8 + 4) // 5
+    full = count - 1                    # parts before the last, all per_each long
+    bpp = per_each // 8                 # blocks in each of those
+    assert full == 0 or per_each % 8 == 0, 'parts must split on blocks'
+    assert full * per_each < nchars <= count * per_each, 'wrong number of parts'
+
+    nblocks = (n + 4) // 5
+    buf = np.empty((count, hl + ((per_each + 7) // 8 * 8)), dtype=np.uint8)
+    buf[:, 0:hl] = np.frombuffer(''.join(headers).encode('ascii'),
+                                    dtype=np.uint8).reshape(count, hl)
+
+    b = _blocks(raw, nblocks)
+    step = max(1, _CHUNK // max(1, bpp))
+    for pos in range(0, full, step):
+        end = min(full, pos + step)
+        encode_blocks(b[pos*bpp:end*bpp].reshape(end - pos, bpp, 5),
+                        buf[pos:end, hl:hl+per_each].reshape(end - pos, bpp, 8))
+
+    rest = b[full*bpp:]
+    encode_blocks(rest, buf[full, hl:hl+(len(rest)*8)].reshape(len(rest), 8))
+
+    rv = [str(memoryview(buf[i, 0:hl+per_each]), 'ascii') for i in range(full)]
+    rv.append(str(memoryview(buf[full, 0:hl+nchars-(full*per_each)]), 'ascii'))
+
+    return rv
+
+def decode_into(text, out):
+    # decode unpadded base32 text into writable buffer; returns number of bytes
+    if isinstance(text, str):
+        text = text.encode('ascii')
+
+    n = len(text)
+    full, rem = divmod(n, 8)
+    if rem not in _TAIL_BYTES:
+        raise B32Error('Incorrect padding')
+
+    c = _DEC[np.frombuffer(text, dtype=np.uint8)]
+    if (c == 255).any():
+        raise B32Error('Non-base32 digit found')
+
+    nbytes = (full * 5) + _TAIL_BYTES[rem]
+    dest = np.frombuffer(out, dtype=np.uint8)[0:nbytes]
+
+    if rem:
+        c = np.concatenate([c, np.zeros(8 - rem, dtype=np.uint8)])
+        tail = np.empty(5, dtype=np.uint8)
+        _decode_blocks(c[full*8:].reshape(1, 8), tail.reshape(1, 5))
+        dest[full*5:] = tail[0:_TAIL_BYTES[rem]]
+
+    _decode_blocks(c[0:full*8].reshape(full, 8), dest[0:full*5].reshape(full, 5))
+
+    return nbytes
+
+def _decode_blocks(c, out):
+    # (n, 8) char values into (n, 5) bytes
+    for pos in range(0, len(c), _CHUNK):
+        c0, c1, c2, c3, c4, c5, c6, c7 = c[pos:pos+_CHUNK].T
+        o = out[pos:pos+_CHUNK]
+
+        o[:, 0] = (c0 << 3) | (c1 >> 2)
+        o[:, 1] = ((c1 & 3) << 6) | (c2 << 1) | (c3 >> 4)
+        o[:, 2] = ((c3 & 15) << 4) | (c4 >> 1)
+        o[:, 3] = ((c4 & 1) << 7) | (c5 << 2) | (c6 >> 3)
+        o[:, 4] = ((c6 & 7) << 5) | c7
+
+def decode(text):
+    # base32 text (no padding) into bytes
+    out = bytearray((len(text) * 5) // 8)
+    decode_into(text, out)
+    return bytes(out)
+
+# EOF
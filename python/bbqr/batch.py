@@ -0,0 +1,55 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - split or join many unrelated payloads, using a pool of workers
+# - results come back in same order as the inputs
+# - a failure on one item doesn't stop the batch: that item's result is
+#   the exception instead
+#
+import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .split import split_qrs
+from .join import join_qrs
+
+def _split_one(item, type_code=None, **kws):
+    # item is raw data, or (raw, type_code)
+    try:
+        if isinstance(item, tuple):
+            item, type_code = item
+        return split_qrs(item, type_code, **kws)
+    except Exception as exc:
+        return exc
+
+def _join_one(parts):
+    try:
+        return join_qrs(list(parts))
+    except Exception as exc:
+        return exc
+
+def _run(fn, items, jobs, processes):
+    # map fn over items using pool; keeps order
+    items = list(items)
+    jobs = min(jobs or os.cpu_count() or 1, max(1, len(items)))
+
+    if jobs <= 1:
+        return [fn(i) for i in items]
+
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    chunksize = max(1, len(items) // (jobs * 4)) if processes else 1
+
+    with pool(max_workers=jobs) as ex:
+        return list(ex.map(fn, items, chunksize=chunksize))
+
+def split_many(items, type_code=None, jobs=None, processes=False, **kws):
+    # Split each payload: list of (version, parts) or exception, in order.
+    # - items are raw data (bytes/str) or (raw, type_code) tuples
+    # - jobs: size of pool, None for one per CPU; processes: use processes not threads
+    # - other args as for split_qrs()
+    return _run(partial(_split_one, type_code=type_code, **kws), items, jobs, processes)
+
+def join_many(part_lists, jobs=None, processes=False):
+    # Join each list of parts: list of (file_type, raw) or exception, in order.
+    return _run(_join_one, part_lists, jobs, processes)
+
+# EOF
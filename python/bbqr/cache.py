@@ -0,0 +1,221 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - content-addressed cache for results that are slow to make: split parts, and
+#   rendered image files. When the same PSBT is shown again, just look it up.
+# - key is a hash of the payload plus every parameter that affects the result
+# - two tiers: LRU in memory, and optionally a directory on disk, both limited by size
+#
+import os, threading
+from hashlib import sha256
+from collections import OrderedDict
+from .split import split_qrs
+
+def _stable(v):
+    # something with the same repr() each run: functions by name, not address
+    if isinstance(v, tuple):
+        return tuple(_stable(i) for i in v)
+    if callable(v):
+        return f'{v.__module__}.{v.__qualname__}'
+    return v
+
+def make_key(kind, *data, **params):
+    # Hash of what kind of result, its input data (bytes or str) and parameters
+    # - params must have a stable repr() to be useful across runs (disk tier)
+    h = sha256(kind.encode('ascii') + b'\0')
+    params = sorted((k, _stable(v)) for k, v in params.items())
+    h.update(repr(params).encode('utf-8') + b'\0')
+    for d in data:
+        if isinstance(d, str):
+            d = d.encode('utf-8')
+        h.update(len(d).to_bytes(8, 'big'))
+        h.update(d)
+
+    return h.hexdigest()
+
+def is_key(name):
+    # made by make_key()? Only those files in the cache directory are ours: anything
+    # else there is left alone (never counted, evicted or cleared)
+    return len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+
+class BBQrCache:
+    # - values are bytes
+    # - max_mem: bytes to keep in memory; path: directory for disk tier (None for no disk)
+    # - max_disk: bytes on disk, oldest-used files are deleted beyond that
+    # - only keys from make_key() are kept on disk; others are memory only
+    # - safe to share between threads
+
+    def __init__(self, max_mem=16<<20, path=None, max_disk=256<<20):
+        self.max_mem = max_mem
+        self.max_disk = max_disk
+        self.path = path
+
+        self.mem = OrderedDict()        # key => bytes, least recently used first
+        self.mem_size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self.disk_size = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self.disk_size = sum(sz for _, _, sz in self._disk_files())
+
+    def get(self, key):
+        # cached value or None
+        with self.lock:
+            rv = self.mem.get(key)
+            if rv is not None:
+                self.mem.move_to_end(key)
+                self.hits += 1
+                return rv
+
+        rv = self._disk_get(key)
+
+        with self.lock:
+            if rv is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.disk_hits += 1
+            self._mem_put(key, rv)
+
+        return rv
+
+    def put(self, key, value):
+        assert isinstance(value, bytes), 'values are bytes'
+
+        with self.lock:
+            self._mem_put(key, value)
+
+        if self.path:
+            self._disk_put(key, value)
+
+    def fetch(self, key, build):
+        # cached value, or make it with build() and remember it
+        rv = self.get(key)
+        if rv is None:
+            rv = build()
+            self.put(key, rv)
+        return rv
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, disk_hits=self.disk_hits,
+                        evictions=self.evictions, mem_size=self.mem_size,
+                        disk_size=self.disk_size, items=len(self.mem))
+
+    def clear(self):
+        # forget everything, both tiers
+        with self.lock:
+            self.mem.clear()
+            self.mem_size = 0
+
+            for fn, _, _ in self._disk_files():
+                os.remove(fn)
+            self.disk_size = 0
+
+    def _mem_put(self, key, value):
+        # caller holds lock
+        if len(value) > self.max_mem:
+            return
+
+        old = self.mem.pop(key, None)
+        if old is not None:
+            self.mem_size -= len(old)
+
+        self.mem[key] = value
+        self.mem_size += len(value)
+
+        while self.mem_size > self.max_mem:
+            _, v = self.mem.popitem(last=False)
+            self.mem_size -= len(v)
+            self.evictions += 1
+
+    def _fname(self, key):
+        return os.path.join(self.path, key)
+
+    def _disk_files(self):
+        # (filename, last used, size) of each value on disk
+        if not self.path:
+            return []
+
+        rv = []
+        for e in os.scandir(self.path):
+            if is_key(e.name) and e.is_file():
+                st = e.stat()
+                rv.append((e.path, st.st_mtime, st.st_size))
+        return rv
+
+    def _disk_get(self, key):
+        if not self.path or not is_key(key):
+            return None
+
+        fn = self._fname(key)
+        try:
+            with open(fn, 'rb') as fd:
+                rv = fd.read()
+            os.utime(fn)            # mtime is our "last used" for eviction
+        except FileNotFoundError:
+            return None
+
+        return rv
+
+    def _disk_put(self, key, value):
+        if len(value) > self.max_disk or not is_key(key):
+            return
+
+        fn = self._fname(key)
+        tmp = f'{fn}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as fd:
+            fd.write(value)
+
+        try:
+            old = os.path.getsize(fn)
+        except FileNotFoundError:
+            old = 0
+        os.replace(tmp, fn)
+
+        with self.lock:
+            self.disk_size += len(value) - old
+            if self.disk_size > self.max_disk:
+                self._disk_evict()
+
+    def _disk_evict(self):
+        # remove least recently used files, until under limit; caller holds lock
+        files = sorted(self._disk_files(), key=lambda f: f[1])
+        self.disk_size = sum(f[2] for f in files)
+
+        for fn, _, sz in files:
+            if self.disk_size <= self.max_disk:
+                break
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+            self.disk_size -= sz
+            self.evictions += 1
+
+def split_qrs_cached(cache, raw, type_code, **kws):
+    # split_qrs(), remembering result: returns (version, parts)
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8')
+
+    # - stats and plan (see split_qrs) don't change the result, so aren't part of key;
+    #   they are only filled when not found in cache
+    stats, plan = kws.pop('stats', None), kws.pop('plan', None)
+
+    key = make_key('split', raw, type_code=type_code, **kws)
+    def build():
+        ver, parts = split_qrs(raw, type_code, stats=stats, plan=plan, **kws)
+        return '\n'.join([str(ver)] + parts).encode('ascii')
+
+    ver, *parts = cache.fetch(key, build).decode('ascii').split('\n')
+
+    return int(ver), parts
+
+# EOF
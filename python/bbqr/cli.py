@@ -5,9 +5,11 @@
 # This code will be added to you path when you do "pip install" on the BBQr package.
 #
 #
-import click, sys, os, pdb, io, random
+import click, sys, os, pdb, io, random, mmap
 from bbqr import split_qrs, join_qrs
 from bbqr.consts import FILETYPE_NAMES, KNOWN_FILETYPES
+from bbqr.utils import detect_filetype
+from bbqr.stats import stage
 
 # Cleanup display (supress traceback) for user-feedback exceptions
 #_sys_excepthook = sys.excepthook
@@ -38,25 +40,53 @@ def show_table():
     from bbqr import tables
     tables.dump_table()
 
-@main.command('decode')
-@click.option('--raw', '-r',  help="Output data as raw binary", is_flag=True)
-def decode_bbqr(raw):
-    """Undo a received BBQr series, back into useful data."""
+# text files holding a BBQr series, one part per line
+BATCH_SUFFIX = '.bbqr'
 
-    if sys.stdin.isatty():
-        print(f"Paste data received, in any order here. Newlines between them.", file=sys.stderr)
+def batch_files(dirname, want_suffix):
+    # regular files in directory, sorted; either with suffix, or without it
+    rv = []
+    for fn in sorted(os.listdir(dirname)):
+        if fn.startswith('.') or not os.path.isfile(os.path.join(dirname, fn)):
+            continue
+        if fn.endswith(BATCH_SUFFIX) == want_suffix:
+            rv.append(fn)
+    return rv
 
-    lines = [ln.strip() for ln in sys.stdin.readlines() if ln.strip()]
+def decode_batch(dirname, outdir, jobs):
+    # decode every .bbqr file in a directory, on a pool of processes
+    from bbqr.batch import join_many
 
-    try:
-        file_type, data = join_qrs(lines)
-    except Exception as exc:
-        print(f"Error: {exc}")
-        return 1
+    names = batch_files(dirname, True)
+    lists = [[ln.strip() for ln in open(os.path.join(dirname, fn), 'rt') if ln.strip()]
+                for fn in names]
+
+    fails = 0
+    for fn, rv in zip(names, join_many(lists, jobs=jobs, processes=True)):
+        out = os.path.join(outdir, fn[:-len(BATCH_SUFFIX)])
+        if not isinstance(rv, Exception) and os.path.exists(out):
+            rv = FileExistsError(f"{out!r} exists, not overwritten")
+
+        if isinstance(rv, Exception):
+            print(f"{fn}: Error: {rv}", file=sys.stderr)
+            fails += 1
+            continue
 
+        file_type, data = rv
+        with open(out, 'wb') as fd:
+            fd.write(data)
+
+        print(f"{fn}: {FILETYPE_NAMES.get(file_type, file_type)}, {len(data)} bytes -> {out!r}")
+
+    return 1 if fails else 0
+
+def show_result(file_type, data, raw=False):
+    # output decoded data, in a form that suits its type
     if raw:
-        click.get_binary_stream('stdout').write(data)
-        return 0
+        out = click.get_binary_stream('stdout')
+        out.write(data)
+        out.flush()
+        return
     
     if file_type == 'J':
         # pretty-print JSON
@@ -79,7 +109,7 @@ def decode_bbqr(raw):
         print(b2a_hex(data))
 
     elif file_type in 'XBRSE':
-        print(f"{FILETYPE_NAMES[file_type]}: {len(data)} bytes of binary data (not shown)", file=sys.stderr)
+        print(f"{FILETYPE_NAMES.get(file_type, file_type)}: {len(data)} bytes of binary data (not shown)", file=sys.stderr)
 
     elif file_type == 'C':
         print(f"{len(data)} bytes of raw CBOR data... (not shown)", file=sys.stderr)
@@ -87,10 +117,146 @@ def decode_bbqr(raw):
     else:
         print(f'Unknown file type code: {file_type}')
 
+    sys.stdout.flush()
+
+def decode_follow(fd, raw=False, once=False):
+    # Read parts a line at a time (ie. from a barcode scanner), and output each
+    # series as soon as its last part arrives. Other lines are ignored.
+    # - handles several series, one after another or mixed together
+    from bbqr.demux import BBQrDemux
+
+    demux = BBQrDemux()
+    count = 0
+
+    for ln in iter(fd.readline, ''):
+        # some tools put a prefix on each line: "QR-Code:B$..."
+        pos = ln.find('B$')
+        if pos < 0:
+            continue
+
+        try:
+            done = demux.add(ln[pos:].strip())
+        except Exception:
+            # not BBQr after all, or garbled
+            continue
+
+        while demux.errors:
+            print(f"\nError: {demux.errors.pop(0)}", file=sys.stderr)
+
+        prog = ' '.join(f'{seen}/{total}' for seen, total in demux.progress)
+        print(f"\rParts: {prog or '-'}\x1b[K", file=sys.stderr, end='', flush=True)
+
+        for file_type, data in done:
+            print(f"\rGot {FILETYPE_NAMES.get(file_type, file_type)}: {len(data)} bytes\x1b[K",
+                        file=sys.stderr)
+            show_result(file_type, data, raw)
+            count += 1
+            if once:
+                return 0
+
+    print('', file=sys.stderr)
+
+    return 0 if count else 1
+
+@main.command('decode')
+@click.option('--raw', '-r',  help="Output data as raw binary", is_flag=True)
+@click.option('--follow', '-f', is_flag=True,
+                    help="Read parts as they arrive (ie. from a scanner), output each series when complete")
+@click.option('--once', is_flag=True, help="With --follow, stop after first series")
+@click.option('--batch', metavar="DIR", default=None,
+                    type=click.Path(exists=True, file_okay=False),
+                    help="Decode every *.bbqr file in directory (one part per line)")
+@click.option('--outdir', metavar="DIR", default=None,
+                    type=click.Path(exists=True, file_okay=False, writable=True),
+                    help="Where batch results go (default: same directory)")
+@click.option('--jobs', '-j', metavar="NUM", default=0, type=int,
+                    help="Worker processes for batch mode (default: 0, for all CPUs)")
+def decode_bbqr(raw, follow=False, once=False, batch=None, outdir=None, jobs=0):
+    """Undo a received BBQr series, back into useful data."""
+
+    if batch:
+        sys.exit(decode_batch(batch, outdir or batch, jobs))
+
+    if follow:
+        sys.exit(decode_follow(sys.stdin, raw, once))
+
+    if sys.stdin.isatty():
+        print(f"Paste data received, in any order here. Newlines between them.", file=sys.stderr)
+
+    lines = [ln.strip() for ln in sys.stdin.readlines() if ln.strip()]
+
+    try:
+        file_type, data = join_qrs(lines)
+    except Exception as exc:
+        print(f"Error: {exc}")
+        return 1
 
+    show_result(file_type, data, raw)
+
+
+
+def map_file(fd):
+    # contents of file: mapped into memory if we can, so no copy is made
+    try:
+        return memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError, io.UnsupportedOperation):
+        # pipes, empty files, etc.
+        return fd.read()
+
+def make_batch(dirname, outdir, jobs, filetype=None, **kws):
+    # split every file in a directory, on a pool of processes, into .bbqr text files
+    from bbqr.batch import split_many
+
+    names = batch_files(dirname, False)
+    results = {}
+    todo = []
+    for fn in names:
+        raw = open(os.path.join(dirname, fn), 'rb').read()
+        try:
+            todo.append((fn, (filetype, raw) if filetype else detect_filetype(fn, raw)))
+        except Exception as exc:
+            results[fn] = exc
+
+    items = [(raw, ft) for _, (ft, raw) in todo]
+    for (fn, _), rv in zip(todo, split_many(items, jobs=jobs, processes=True, **kws)):
+        results[fn] = rv
+
+    fails = 0
+    for fn in names:
+        rv = results[fn]
+        if isinstance(rv, Exception):
+            print(f"{fn}: Error: {rv}", file=sys.stderr)
+            fails += 1
+            continue
+
+        vers, parts = rv
+        out = os.path.join(outdir, fn + BATCH_SUFFIX)
+        with open(out, 'wt') as fd:
+            fd.write('\n'.join(parts) + '\n')
+
+        print(f"{fn}: {len(parts)} QR's of version {vers} -> {out!r}")
+
+    return 1 if fails else 0
+
+@main.command('serve')
+@click.option('--host', metavar="ADDR", default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+@click.option('--port', '-p', metavar="PORT", default=8080, type=int, help="TCP port (default: 8080)")
+@click.option('--jobs', '-j', metavar="NUM", default=0, type=int,
+                        help="Worker processes (default: one per CPU)")
+@click.option('--max-concurrent', '-c', metavar="NUM", default=None, type=int,
+                        help="Requests handled at once, others get 503 (default: twice the workers)")
+@click.option('--timeout', metavar="SECS", default=30, type=float,
+                        help="Longest a worker can take on a request (default: 30)")
+@click.option('--verbose', '-v', is_flag=True, help="Log each request")
+def serve_http(host, port, jobs=0, max_concurrent=None, timeout=30, verbose=False):
+    """Run a local HTTP service for splitting and joining"""
+    from bbqr.server import serve
+
+    print(f"Listening on http://{host}:{port}/", file=sys.stderr)
+    serve(host, port, jobs=jobs, max_concurrent=max_concurrent, timeout=timeout, verbose=verbose)
 
 @main.command('make')
-@click.argument('infile', type=click.File('rb'))
+@click.argument('infile', type=click.File('rb'), required=False)
 @click.option('--encoding', '-e', metavar="(char)", default=None, type=click.Choice('H2Z'), help="Force low-level encoding: H 2 or Z")
 @click.option('--filetype', '-t', metavar='(char)', default=None, type=click.Choice(KNOWN_FILETYPES), help="Force specific file type code: "+''.join(KNOWN_FILETYPES))
 @click.option('--max-version', '-v', metavar="[1-40]", default=40,
@@ -102,121 +268,197 @@ def decode_bbqr(raw):
 @click.option('--scale', '-s', metavar="NUM", default=4,
                         help="For image outputs, the size of each QR pixel (default: 4)")
 @click.option('--outfile', '-o', metavar="filename.png",
-                        help="Name for output file", default=None,
+                        help="Name for output file: png, apng, gif, webp or svg", default=None,
                         type=click.Path(dir_okay=False, writable=True, allow_dash=True))
 @click.option('--fake-data', help="Generate huge empty data", type=int)
 @click.option('--randomize-order', '-r',  help="Shuffle output parts into random ordering", is_flag=True)
-def make_qrs(randomize_order, infile=None, outfile=None, encoding=None, scale=4, max_version=40, frame_delay=250, min_split=1, fake_data=None, filetype=None):
+@click.option('--jobs', '-j', metavar="NUM", default=1, type=int,
+                        help="Worker processes for building images (default: 1, 0 for all CPUs)")
+@click.option('--compress-jobs', metavar="NUM", default=1, type=int,
+                        help="Threads for compressing big files; gives slightly different"
+                                " (bigger) output than one thread (default: 1, 0 for all CPUs)")
+@click.option('--compress-search', metavar="SECS", default=None, type=float,
+                        help="Spend up to this long trying ZLIB settings, to get fewer QR's")
+@click.option('--optimize', '-O', is_flag=True,
+                        help="Pick encoding by number of QR's needed, and show the options")
+@click.option('--scan-fps', metavar="FPS", default=None, type=float,
+                        help="Pick QR version for fastest scanning by a phone camera at this frame rate")
+@click.option('--animated-svg', is_flag=True,
+                    help="For SVG output, make one animated file, rather than a file per QR")
+@click.option('--cache', 'cache_dir', metavar="DIR", default=None,
+                    type=click.Path(file_okay=False, writable=True),
+                    help="Keep parts and images in this directory, and reuse them next time")
+@click.option('--profile', is_flag=True,
+                    help="Show time spent (and bytes processed) in each step")
+@click.option('--profile-memory', is_flag=True,
+                    help="With --profile, also show memory allocated by each step (slower)")
+@click.option('--batch', metavar="DIR", default=None,
+                    type=click.Path(exists=True, file_okay=False),
+                    help="Split every file in directory into a *.bbqr text file")
+@click.option('--outdir', metavar="DIR", default=None,
+                    type=click.Path(exists=True, file_okay=False, writable=True),
+                    help="Where batch results go (default: same directory)")
+def make_qrs(randomize_order, infile=None, outfile=None, encoding=None, scale=4, max_version=40, frame_delay=250, min_split=1, fake_data=None, filetype=None, jobs=1, compress_jobs=1, compress_search=None, optimize=False, scan_fps=None, animated_svg=False, cache_dir=None, profile=False, profile_memory=False, batch=None, outdir=None):
     """Encode file as a series of QR codes"""
 
+    stats = None
+    if profile or profile_memory:
+        from bbqr.stats import Stats
+        stats = Stats(memory=profile_memory)
+        click.get_current_context().call_on_close(
+                    lambda: print('\n' + stats.report(), file=sys.stderr))
+
+    scanner = None
+    if scan_fps:
+        from bbqr.scanner import ScannerModel
+        scanner = ScannerModel(scan_fps, frame_delay=frame_delay / 1000.0)
+
+    if batch:
+        sys.exit(make_batch(batch, outdir or batch, jobs, filetype=filetype,
+                                encoding=encoding, max_version=max_version,
+                                min_split=min_split, optimize=optimize, scanner=scanner))
+
+    if not infile and not fake_data:
+        raise click.UsageError("Need INFILE (or --batch)")
+
     if fake_data:
         # for Mk4/Q: maximum psbt size
         raw = bytes(fake_data)
     else:
-        raw = infile.read()
+        raw = map_file(infile)
 
     assert len(raw) > 5, 'Input data too short?!'
 
     if not filetype:
-        if '.psb' in infile.name.lower():
-            filetype = 'P'
-            if raw[0:5] != b'psbt\xff':
-                if raw[0:10].decode().isprintable():
-                    print("Someone has saved Base64 or Hex encoded PSBT to disk? We want raw meat.")
-                raise ValueError(infile.name)
-        elif raw[0:8] in { b'01000000', b'02000000'}:
-            # transaction in hex format
-            filetype = 'T'
-            raw = bytes.fromhex(raw.decode('ascii'))
-        elif raw[0:4] in { b'\x01\x00\x00\x00', b'\x02\x00\x00\x00'}:
-            # binary transaction
-            filetype = 'T'
-        elif raw[0] == b'{':
-            # probably JSON
-            filetype = 'J'
-        else:
-            # otherwise text or binary
-            try:
-                raw.decode('utf-8')
-                filetype = 'U'
-            except UnicodeError:
-                filetype = 'B'
+        with stage(stats, 'filetype', len(raw)):
+            filetype, raw = detect_filetype(infile.name if infile else '', raw)
 
         print(f"Detected file type: {filetype} -> {FILETYPE_NAMES[filetype]}", file=sys.stderr)
 
-    vers, parts = split_qrs(raw, type_code=filetype, encoding=encoding,
-                                    max_version=max_version, min_split=min_split)
+    # options the planner considered, when optimizing
+    plan = []
+
+    split_args = dict(encoding=encoding, max_version=max_version, min_split=min_split,
+                        compress_search=compress_search, search_jobs=jobs,
+                        compress_jobs=compress_jobs,
+                        optimize=optimize, scanner=scanner, stats=stats, plan=plan)
+
+    cache = None
+    if cache_dir:
+        from bbqr.cache import BBQrCache, split_qrs_cached, make_key
+        cache = BBQrCache(path=cache_dir)
+        vers, parts = split_qrs_cached(cache, raw, filetype, **split_args)
+    else:
+        vers, parts = split_qrs(raw, type_code=filetype, **split_args)
 
     num_parts = len(parts)
 
+    for o in plan:
+        if o.count is None:
+            print(f"  Encoding {o.encoding}: cannot fit", file=sys.stderr)
+        else:
+            print(f"  Encoding {o.encoding}: {o.count} QR's of version {o.version}"
+                    f" ({len(o.encoded)} chars)", file=sys.stderr)
+
     if len(parts) == 1:
         print(f"A single QR version {vers} will be needed.", file=sys.stderr)
     else:
         print(f"Need {num_parts} QR's each of version {vers}.", file=sys.stderr)
 
+    if scanner:
+        from bbqr.scanner import expected_scan_time
+        print(f"Expected time to scan: {expected_scan_time(scanner, vers, num_parts):.1f} seconds",
+                file=sys.stderr)
+
     if randomize_order:
         random.shuffle(parts)
 
     if not outfile or outfile == '-':
-        for p in parts:
-            print(p)
-            print()
+        with stage(stats, 'write'):
+            for p in parts:
+                print(p)
+                print()
         return 0
 
     if outfile != "text":
         rootpath, ext = os.path.splitext(outfile)
         ext = ext.lower()[1:]
 
-        if ext not in {'png', 'svg', 'gif'}:
+        if ext not in {'png', 'apng', 'svg', 'gif', 'webp'}:
             print(f"Unsupported output file type: {ext}")
             return 1
 
-    import pyqrcode
-    # Render graphics -- very slow!
-    print("Building QR images... ", file=sys.stderr, end='', flush=True)
-    qs = [pyqrcode.create(data, error='L', version=vers, mode='alphanumeric') for
-            data in parts]
-    print("done!", file=sys.stderr)
+    from bbqr import render
 
     if outfile == "stdout":
-        for q in qs:
-            print(q.terminal())
+        for p in parts:
+            print(render.make_qr(p, vers).terminal())
             print("\n\n")
         return 0
 
-    if ext == 'svg':
-        # limitation: doesn't include progress bar animation
-        for i in range(num_parts):
-            fn = f'{rootpath}-{i+1}.{ext}' if num_parts > 1 else outfile
-            qs[i].svg(open(fn, 'wb'), scale=scale)
-            print(f"Created file {fn!r}")
+    # Render graphics -- very slow! (but can use many CPUs)
+    print("Building QR images... ", file=sys.stderr, end='', flush=True)
+
+    if ext == 'svg' and animated_svg:
+        # one file: all frames, with progress bar
+        def build():
+            with stage(stats, 'render', sum(len(p) for p in parts)):
+                return render.make_animated_svg(parts, vers, scale=scale,
+                                                    frame_delay=frame_delay, jobs=jobs)
+        if cache:
+            key = make_key('svg-anim', *parts, vers=vers, scale=scale, frame_delay=frame_delay)
+            svg = cache.fetch(key, build)
+        else:
+            svg = build()
+        print("done!", file=sys.stderr)
+
+        with stage(stats, 'write', len(svg)):
+            with open(outfile, 'wb') as fd:
+                fd.write(svg)
+
+        print(f"Created {outfile!r} with {num_parts} frames.")
+
+    elif ext == 'svg':
+        # limitation: doesn't include progress bar animation (see --animated-svg)
+        def build():
+            with stage(stats, 'render', sum(len(p) for p in parts)):
+                return render.render_svgs(parts, vers, scale=scale, jobs=jobs)
+        if cache:
+            keys = [make_key('svg', p, vers=vers, scale=scale) for p in parts]
+            svgs = [cache.get(k) for k in keys]
+            if None in svgs:
+                svgs = build()
+                for k, svg in zip(keys, svgs):
+                    cache.put(k, svg)
+        else:
+            svgs = build()
+        print("done!", file=sys.stderr)
+
+        with stage(stats, 'write', sum(len(i) for i in svgs)):
+            for i in range(num_parts):
+                fn = f'{rootpath}-{i+1}.{ext}' if num_parts > 1 else outfile
+                open(fn, 'wb').write(svgs[i])
+                print(f"Created file {fn!r}")
         
-    elif ext in { 'png', 'gif' }:
-        from PIL import Image, ImageDraw, ImageChops
-        frames = []
-
-        for i in range(num_parts):
-            xbm = qs[i].xbm(scale=scale, quiet_zone=10)
-            img = ImageChops.invert(Image.open(io.BytesIO(xbm.encode()))).convert('L')
-            if num_parts > 1:
-                # add progress bar
-                pw = img.width // num_parts
-                lm = (img.width - (pw * num_parts)) // 2
-                draw = ImageDraw.Draw(img)
-                h = scale//2
-                y = img.height - h - (scale//2) - 1
-
-                for j in range(num_parts):
-                    draw.rectangle( (lm+(j * pw), y, lm+((j+1)*pw), y+h), fill=(128 if i != j else 0))
-
-            frames.append(img)
-
-        if num_parts == 1:
-            frames[0].save(outfile)
+    elif ext in { 'png', 'apng', 'gif', 'webp' }:
+        build = lambda: render.image_file(parts, vers, ext, scale=scale,
+                                            frame_delay=frame_delay, jobs=jobs, stats=stats)
+
+        if cache:
+            key = make_key(ext, *parts, vers=vers, scale=scale, frame_delay=frame_delay)
+            img = cache.fetch(key, build)
         else:
-            frames[0].save(outfile, format=ext, save_all=True, loop=0,
-                    duration=frame_delay, default_image=False, append_images=frames[1:])
+            img = build()
+        print("done!", file=sys.stderr)
+
+        with stage(stats, 'write', len(img)):
+            with open(outfile, 'wb') as fd:
+                fd.write(img)
+
+        print(f"Created {outfile!r} with {num_parts} frames.")
 
-        print(f"Created {outfile!r} with {len(frames)} frames.")
+    if cache:
+        st = cache.stats
+        print(f"Cache: {st['hits']} hits, {st['misses']} misses", file=sys.stderr)
 
 # EOF
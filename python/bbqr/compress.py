@@ -0,0 +1,99 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - extra effort on ZLIB compression, when fewer QR codes is worth waiting for
+# - every stream made here is raw deflate with a 1k window (wbits=-10), so
+#   any BBQr decoder can still handle it; only the encoder settings differ
+#
+import os, zlib, time
+from math import ceil
+from concurrent.futures import ThreadPoolExecutor
+from .split import find_best_version
+
+STRATEGIES = [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE,
+                zlib.Z_FIXED, zlib.Z_HUFFMAN_ONLY]
+
+def candidate_settings():
+    # all (level, memLevel, strategy) combos worth trying, most promising first
+    # - first one is what encode_data() does by default
+    rv = [(zlib.Z_DEFAULT_COMPRESSION, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY)]
+
+    for strategy in STRATEGIES:
+        for level in range(9, 0, -1):
+            for mem in range(9, 0, -1):
+                if (level, mem, strategy) not in rv:
+                    rv.append((level, mem, strategy))
+
+    return rv
+
+def deflate(raw, level, mem, strategy):
+    # compress with indicated settings; output can be inflated with wbits=-10
+    z = zlib.compressobj(level, zlib.DEFLATED, -10, mem, strategy)
+    return z.compress(raw) + z.flush()
+
+# 1k window (wbits=-10): that's all the history a chunk can use anyway
+WINDOW = 1024
+
+def _deflate_chunk(raw, start, end, last, level):
+    # compress raw[start:end], as if it followed what came before it
+    # - primed with previous window of data, so matches can reach back into it
+    # - sync flush ends on a byte boundary, so next chunk's output can just follow it
+    if start:
+        z = zlib.compressobj(level, zlib.DEFLATED, -10, zlib.DEF_MEM_LEVEL,
+                                zlib.Z_DEFAULT_STRATEGY, zdict=raw[max(0, start-WINDOW):start])
+    else:
+        z = zlib.compressobj(level, zlib.DEFLATED, -10)
+
+    return z.compress(raw[start:end]) + z.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+def parallel_deflate(raw, jobs=0, chunk_size=0x20000, level=zlib.Z_DEFAULT_COMPRESSION):
+    # Same as deflate_default(), but chunks of the data are compressed at the same
+    # time, in threads (zlib releases the GIL), like pigz does.
+    # - one valid raw deflate stream results: decode_data() needs no changes
+    # - a little bigger than single threaded (see bench.py), identical if only one chunk
+    # - jobs: threads, zero for one per CPU
+    raw = memoryview(raw)
+    jobs = jobs or os.cpu_count() or 1
+    starts = range(0, max(1, len(raw)), chunk_size)
+
+    args = [(raw, s, s+chunk_size, s+chunk_size >= len(raw), level) for s in starts]
+    if jobs <= 1 or len(args) <= 1:
+        return b''.join(_deflate_chunk(*a) for a in args)
+
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        return b''.join(ex.map(lambda a: _deflate_chunk(*a), args))
+
+def compress_search(raw, time_budget=1.0, jobs=1, **kws):
+    # Try many compression settings, and keep the one which needs the fewest
+    # QR codes, then lowest version, then fewest bytes.
+    # - stops starting new trials after time_budget seconds (but always tries default)
+    # - jobs > 1 uses threads (zlib releases the GIL), zero for one per CPU
+    # - see find_best_version() for additional kw args
+    # - returns (compressed bytes, (level, memLevel, strategy))
+    deadline = time.monotonic() + time_budget
+    jobs = jobs or os.cpu_count() or 1
+
+    def trial(settings):
+        cmp = deflate(raw, *settings)
+        try:
+            ver, count, _ = find_best_version(ceil(len(cmp) * 8 / 5), 8, **kws)
+        except ValueError:
+            # doesn't fit at all
+            ver = count = 99999
+        return (count, ver, len(cmp)), cmp, settings
+
+    settings = candidate_settings()
+    best = None
+
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        for pos in range(0, len(settings), jobs):
+            if best and time.monotonic() >= deadline:
+                break
+
+            for rv in ex.map(trial, settings[pos:pos+jobs]):
+                if not best or rv[0] < best[0]:
+                    best = rv
+
+    return best[1], best[2]
+
+# EOF
@@ -0,0 +1,123 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - sort parts from several animated series, seen by one scanner, into
+#   separate joins, and give back each payload as soon as it is complete
+# - series are told apart by header; when headers are equal, by whether
+#   the content of parts with the same index agree
+# - memory bounded: least-recently-active series are dropped when there are
+#   too many, or when nothing was seen from them for too long
+#
+import time
+from collections import OrderedDict
+from .join import BBQrJoiner, parse_part
+
+class BBQrDemux:
+    # - add() returns a list of (file_type, raw) for series completed by that part
+    # - a part which could belong to more than one series (same header, and no
+    #   conflicting part at its index yet) goes to just one: the series whose
+    #   last part was the one before it, else the least recently active one.
+    #   This follows screens which are taking turns in front of the camera.
+    # - frames from a series already completed are ignored (it's probably still
+    #   animating on screen), for the last few series completed; unless an open
+    #   series with the same header is still missing that index
+
+    def __init__(self, max_sessions=8, max_age=60, max_recent=8, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.max_age = max_age
+        self.max_recent = max_recent
+        self.clock = clock
+
+        self.sessions = OrderedDict()       # id => [joiner, last seen, last idx], oldest first
+        self.recent = OrderedDict()         # (hdr, frozenset of parts) of completed series
+        self.next_id = 0
+        self.errors = []                    # decode failures, ie. mixed-up series
+
+    def add(self, part):
+        # take one scanned part; returns list of completed results (usually empty)
+        # - raises AssertionError for anything that isn't a BBQr part
+        p = parse_part(part)
+        hdr, idx, part = p.hdr, p.index, p.text
+        now = self.clock()
+
+        self.evict(now)
+
+        same = [(sid, sess) for sid, sess in self.sessions.items() if sess[0].hdr == hdr]
+
+        # part of a series already done: ignore, unless an open series still needs
+        # that index (a new series can share parts with an old one)
+        if not any(idx not in sess[0].data for sid, sess in same):
+            for r_hdr, r_parts in self.recent:
+                if r_hdr == hdr and part in r_parts:
+                    return []
+
+        # already have it: just note activity
+        dups = [sid for sid, sess in same if sess[0].data.get(idx) == part]
+        if dups:
+            for sid in dups:
+                self.touch(sid, now, idx)
+            return []
+
+        # sessions this part could belong to; oldest activity first
+        fits = [sid for sid, sess in same if idx not in sess[0].data]
+        follow = [sid for sid in fits if self.sessions[sid][2] == idx-1]
+
+        if fits:
+            sid = (follow or fits)[0]
+            j = self.sessions[sid][0]
+            j.add(p)
+        else:
+            # conflicts with all we have (or new header): a new series
+            j = BBQrJoiner(defer=True)
+            j.add(p)
+
+            # make room: least recently active goes
+            while len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)
+
+            sid = self.next_id
+            self.next_id += 1
+            self.sessions[sid] = [j, now, idx]
+
+        self.touch(sid, now, idx)
+
+        if not j.have_all:
+            return []
+
+        del self.sessions[sid]
+        try:
+            rv = j.decode()
+        except Exception as exc:
+            self.errors.append(exc)
+            return []
+
+        # remember it, so we can ignore it while it keeps looping on screen
+        mine = frozenset(j.data.values())
+        self.recent[j.hdr, mine] = True
+        while len(self.recent) > self.max_recent:
+            self.recent.popitem(last=False)
+
+        return [rv]
+
+    def touch(self, sid, now, idx):
+        sess = self.sessions[sid]
+        sess[1] = now
+        sess[2] = idx
+        self.sessions.move_to_end(sid)
+
+    def evict(self, now=None):
+        # drop series we haven't seen in a while (oldest are first)
+        now = self.clock() if now is None else now
+
+        while self.sessions:
+            sid, sess = next(iter(self.sessions.items()))
+            if (now - sess[1]) <= self.max_age:
+                break
+            del self.sessions[sid]
+
+    @property
+    def progress(self):
+        # (number seen, total expected) for each active series, oldest first
+        return [s[0].progress for s in self.sessions.values()]
+
+# EOF
@@ -3,45 +3,160 @@
 #
 # - joins QR codes
 #
-from .utils import decode_data
-from .consts import HEADER_LEN, KNOWN_FILETYPES
+from collections import namedtuple
+from .utils import decode_data, StreamDecoder, int2base36
+from .consts import HEADER_LEN
+from .stats import stage
 
-def join_qrs(parts):
-    # take a bunch of scanned data. 
-    # - put into order, decode, return type code and raw data bytes
-    # - lazy desktop code here
-    hdr = set(p[0:6] for p in parts)
-    assert len(hdr) == 1, 'conflicting/variable filetype/encodings/sizes'
-    hdr = hdr.pop()
+# two-digit base36 fields of header: '00' thru 'ZZ' => 0..1295
+_BASE36 = {int2base36(n): n for n in range(1296)}
 
-    assert hdr[0:2] == 'B$', 'fixed header not found, expected B$'
-    encoding = hdr[2]
-    file_type = hdr[3]
-    num_parts = int(hdr[4:6], 36)
+class BBQrPart(namedtuple('BBQrPart', 'text encoding file_type num_parts index')):
+    # One scanned part, with header decoded. Keeps the text as scanned:
+    # payload is not copied out until .body is used (decode_data can skip the header instead).
+    __slots__ = ()
 
-    assert num_parts >= 1, 'zero parts?'
+    @property
+    def hdr(self):
+        # part of header that is same for whole series
+        return self.text[0:6]
+
+    @property
+    def body(self):
+        return self.text[HEADER_LEN:]
+
+def parse_part(text):
+    # Check header of a scanned part and decode it: returns BBQrPart
+    # - cheap enough to reject non-BBQr frames from camera (AssertionError)
+    assert len(text) >= HEADER_LEN and text[0:2] == 'B$', 'fixed header not found, expected B$'
+
+    encoding = text[2]
     assert encoding in 'H2Z', f'bad encoding: {encoding}'
 
-    # ok to have dups here, just need them all
-    data = {}
-    for p in parts:
-        idx = int(p[6:8], 36)
-        assert idx < num_parts, f'got part {idx} but only expecting {num_parts}'
+    # any letter: newer file types still join, only split is limited to KNOWN_FILETYPES
+    file_type = text[3]
+    assert 'A' <= file_type <= 'Z', f'bad file type: {file_type}'
+
+    num_parts = _BASE36.get(text[4:6])
+    index = _BASE36.get(text[6:8])
+    assert num_parts is not None and index is not None, 'bad base36 in header'
+    assert num_parts >= 1, 'zero parts?'
+    assert index < num_parts, f'got part {index} but only expecting {num_parts}'
+
+    return BBQrPart(text, encoding, file_type, num_parts, index)
+
+class BBQrJoiner:
+    # Collect scanned parts one at a time, as they arrive from the camera.
+    # - each add() is constant work: no rescan of previously seen parts
+    # - conflicts and bad dups are reported on the part that causes them
+    # - add() returns (file_type, raw) as soon as the last part is seen, else None
+    # - with stream=True, parts are decoded as soon as they form a contiguous prefix,
+    #   and raw is a readable file-like object (also available early, as .stream)
+    # - with defer=True, add() never decodes: check have_all, then call decode() yourself
+    # - stats: optional Stats object, gets timing of decode steps (see stats.py)
+
+    def __init__(self, stream=False, defer=False, stats=None):
+        self.want_stream = stream
+        self.stats = stats
+        self.defer = defer
+        self.stream = None
+        self.hdr = None
+        self.encoding = None
+        self.file_type = None
+        self.num_parts = None
+        self.data = {}
+        self._missing = None
+        self.result = None
+
+    def add(self, part):
+        # take one scanned part (text, or BBQrPart); returns decoded result when series is complete
+        if not isinstance(part, BBQrPart):
+            part = parse_part(part)
+
+        if self.hdr is None:
+            self.hdr = part.hdr
+            self.encoding = part.encoding
+            self.file_type = part.file_type
+            self.num_parts = part.num_parts
+            self._missing = set(range(part.num_parts))
+
+            if self.want_stream:
+                self.stream = StreamDecoder(part.encoding, part.num_parts)
+        else:
+            assert (part.encoding, part.file_type, part.num_parts) \
+                    == (self.encoding, self.file_type, self.num_parts), \
+                    'conflicting/variable filetype/encodings/sizes'
+
+        idx, part = part.index, part.text
 
-        if idx in data:
-            assert data[idx] == p[8:], f'dup part 0x{idx:02x} has wrong content'
+        # ok to have dups here, just need them all
+        # - keep whole part as scanned (header already checked), no copies
+        if idx in self.data:
+            assert self.data[idx] == part, f'dup part 0x{idx:02x} has wrong content'
         else:
-            data[idx] = p[8:]
+            self.data[idx] = part
+            self._missing.discard(idx)
+
+            if self.stream is not None:
+                self.stream.add(idx, part[HEADER_LEN:])
+                if not self._missing:
+                    self.result = (self.file_type, self.stream)
+
+            elif not self._missing and not self.defer:
+                self.decode()
+
+        return self.result
+
+    def decode(self):
+        # all parts are here: decode them, and return (file_type, raw)
+        assert self.have_all, f'parts missing: {self.missing!r}'
+
+        if self.result is None:
+            parts = [self.data[i] for i in range(self.num_parts)]
+            raw = decode_data(parts, self.encoding, skip=HEADER_LEN, stats=self.stats)
+
+            # maybe: decode objects here... U=>text, C=>obj, J=>obj
+
+            self.result = (self.file_type, raw)
 
-    missing = set(range(num_parts)) - set(data)
-    assert not missing, f'parts missing: {missing!r}'
+        return self.result
+
+    @property
+    def have_all(self):
+        # every part has been seen (but maybe not decoded yet)
+        return self._missing is not None and not self._missing
+
+    @property
+    def is_complete(self):
+        return self.result is not None
+
+    @property
+    def missing(self):
+        # set of part numbers not yet seen (empty before first part)
+        return set(self._missing) if self._missing is not None else set()
+
+    @property
+    def progress(self):
+        # (number seen, total expected) -- total is None before first part
+        return len(self.data), self.num_parts
+
+def join_qrs(parts, stats=None):
+    # take a bunch of scanned data.
+    # - put into order, decode, return type code and raw data bytes
+    # - lazy desktop code here
+    # - stats: optional Stats object (see stats.py)
+    assert parts, 'no parts provided'
 
-    parts = [data[i] for i in range(num_parts)]
+    j = BBQrJoiner(defer=True, stats=stats)
+    with stage(stats, 'parse', sum(len(p) for p in parts) if stats else 0):
+        for p in parts:
+            j.add(p)
 
-    raw = decode_data(parts, encoding)
+    if j.have_all:
+        j.decode()
 
-    # maybe: decode objects here... U=>text, C=>obj, J=>obj
+    assert j.is_complete, f'parts missing: {j.missing!r}'
 
-    return file_type, raw
+    return j.result
 
 # EOF
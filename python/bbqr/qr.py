@@ -0,0 +1,348 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - QR encoder for exactly what BBQr needs: alphanumeric mode, ECC level L
+# - requires numpy; everything that depends only on the version (function
+#   patterns, data module path, mask patterns) is computed once and cached
+# - produces same matrix as pyqrcode, including its choice of mask
+#
+import numpy as np
+from functools import lru_cache
+from .consts import version_size
+
+# Per version, for ECC level L:
+#   (ECC codewords per block, blocks in group 1, data codewords each, blocks in group 2, data codewords each)
+ECC_BLOCKS_L = [ None,
+    (7, 1, 19, 0, 0), (10, 1, 34, 0, 0), (15, 1, 55, 0, 0), (20, 1, 80, 0, 0),
+    (26, 1, 108, 0, 0), (18, 2, 68, 0, 0), (20, 2, 78, 0, 0), (24, 2, 97, 0, 0),
+    (30, 2, 116, 0, 0), (18, 2, 68, 2, 69), (20, 4, 81, 0, 0), (24, 2, 92, 2, 93),
+    (26, 4, 107, 0, 0), (30, 3, 115, 1, 116), (22, 5, 87, 1, 88), (24, 5, 98, 1, 99),
+    (28, 1, 107, 5, 108), (30, 5, 120, 1, 121), (28, 3, 113, 4, 114), (28, 3, 107, 5, 108),
+    (28, 4, 116, 4, 117), (28, 2, 111, 7, 112), (30, 4, 121, 5, 122), (30, 6, 117, 4, 118),
+    (26, 8, 106, 4, 107), (28, 10, 114, 2, 115), (30, 8, 122, 4, 123), (30, 3, 117, 10, 118),
+    (30, 7, 116, 7, 117), (30, 5, 115, 10, 116), (30, 13, 115, 3, 116), (30, 17, 115, 0, 0),
+    (30, 17, 115, 1, 116), (30, 13, 115, 6, 116), (30, 12, 121, 7, 122), (30, 6, 121, 14, 122),
+    (30, 17, 122, 4, 123), (30, 4, 122, 18, 123), (30, 20, 117, 4, 118), (30, 19, 118, 6, 119),
+]
+
+# Row/column centers of alignment patterns
+ALIGNMENT_POS = [ None, [],
+    [6, 18], [6, 22], [6, 26], [6, 30], [6, 34], [6, 22, 38], [6, 24, 42], [6, 26, 46],
+    [6, 28, 50], [6, 30, 54], [6, 32, 58], [6, 34, 62], [6, 26, 46, 66], [6, 26, 48, 70],
+    [6, 26, 50, 74], [6, 30, 54, 78], [6, 30, 56, 82], [6, 30, 58, 86], [6, 34, 62, 90],
+    [6, 28, 50, 72, 94], [6, 26, 50, 74, 98], [6, 30, 54, 78, 102], [6, 28, 54, 80, 106],
+    [6, 32, 58, 84, 110], [6, 30, 58, 86, 114], [6, 34, 62, 90, 118],
+    [6, 26, 50, 74, 98, 122], [6, 30, 54, 78, 102, 126], [6, 26, 52, 78, 104, 130],
+    [6, 30, 56, 82, 108, 134], [6, 34, 60, 86, 112, 138], [6, 30, 58, 86, 114, 142],
+    [6, 34, 62, 90, 118, 146], [6, 30, 54, 78, 102, 126, 150], [6, 24, 50, 76, 102, 128, 154],
+    [6, 28, 54, 80, 106, 132, 158], [6, 32, 58, 84, 110, 136, 162],
+    [6, 26, 54, 82, 110, 138, 166], [6, 30, 58, 86, 114, 142, 170],
+]
+
+# Alphanumeric mode character set, in order of value
+ALNUM_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+
+# ASCII to alphanumeric value, 255 for invalid
+_ALNUM_LOOKUP = np.full(256, 255, dtype=np.uint8)
+_ALNUM_LOOKUP[np.frombuffer(ALNUM_CHARS.encode('ascii'), dtype=np.uint8)] = np.arange(45)
+
+# GF(256) with QR polynomial: full multiplication table (64k)
+def _gf_tables():
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= 0x11d
+    exp[255:510] = exp[0:255]
+
+    mul = exp[(log[:, None] + log[None, :])].astype(np.uint8)
+    mul[0, :] = 0
+    mul[:, 0] = 0
+
+    return exp, mul
+
+_GF_EXP, _GF_MUL = _gf_tables()
+
+@lru_cache(maxsize=None)
+def _generator(ec):
+    # Reed-Solomon generator polynomial of degree ec, highest term first (always 1)
+    g = np.array([1], dtype=np.uint8)
+    for i in range(ec):
+        # multiply by (x - a^i)
+        ng = np.zeros(len(g)+1, dtype=np.uint8)
+        ng[:-1] = g
+        ng[1:] ^= _GF_MUL[g, _GF_EXP[i]]
+        g = ng
+    return g
+
+def _bch(value, poly, poly_bits):
+    # remainder of value * x^(bits-1) divided by poly, for format/version info
+    v = value << (poly_bits - 1)
+    while v.bit_length() >= poly_bits:
+        v ^= poly << (v.bit_length() - poly_bits)
+    return (value << (poly_bits - 1)) | v
+
+def format_bits(mask):
+    # 15 bits of format info, for ECC level L (01), MSB first
+    return _bch((0b01 << 3) | mask, 0x537, 11) ^ 0x5412
+
+def version_bits(ver):
+    # 18 bits of version info (version 7+), MSB first
+    return _bch(ver, 0x1f25, 13)
+
+@lru_cache(maxsize=None)
+def _template(ver):
+    # Function patterns that are same for every QR of this version.
+    # - returns (modules, reserved) where reserved marks non-data positions
+    #   (including format info areas, which vary with mask)
+    n = version_size(ver)
+    m = np.zeros((n, n), dtype=np.uint8)
+    res = np.zeros((n, n), dtype=bool)
+
+    # finder patterns, and their separators
+    finder = np.zeros((7, 7), dtype=np.uint8)
+    finder[[0, 6], :] = 1
+    finder[:, [0, 6]] = 1
+    finder[2:5, 2:5] = 1
+    for r, c in [(0, 0), (0, n-7), (n-7, 0)]:
+        m[r:r+7, c:c+7] = finder
+    res[0:8, 0:8] = res[0:8, n-8:] = res[n-8:, 0:8] = True
+
+    # timing lines
+    m[6, 8:n-8] = m[8:n-8, 6] = (np.arange(8, n-8) + 1) % 2
+    res[6, :] = res[:, 6] = True
+
+    # alignment patterns: not where they would overlap finders
+    pos = ALIGNMENT_POS[ver]
+    if pos:
+        align = np.ones((5, 5), dtype=np.uint8)
+        align[1:4, 1:4] = 0
+        align[2, 2] = 1
+        lo, hi = pos[0], pos[-1]
+        for r in pos:
+            for c in pos:
+                if (r, c) in [(lo, lo), (lo, hi), (hi, lo)]:
+                    continue
+                m[r-2:r+3, c-2:c+3] = align
+                res[r-2:r+3, c-2:c+3] = True
+
+    # version info, two copies
+    if ver >= 7:
+        bits = version_bits(ver)
+        blk = np.array([(bits >> k) & 1 for k in range(18)], dtype=np.uint8).reshape(6, 3)
+        m[0:6, n-11:n-8] = blk
+        m[n-11:n-8, 0:6] = blk.T
+        res[0:6, n-11:n-8] = res[n-11:n-8, 0:6] = True
+
+    # format info areas, and the dark module
+    res[8, 0:9] = res[0:9, 8] = True
+    res[8, n-8:] = res[n-8:, 8] = True
+    m[n-8, 8] = 1
+
+    return m, res
+
+@lru_cache(maxsize=None)
+def _data_path(ver):
+    # flat indices of data modules, in order bits are placed (zig-zag up/down column pairs)
+    n = version_size(ver)
+    _, res = _template(ver)
+
+    order = []
+    upward = True
+    for right in range(n-1, 0, -2):
+        if right <= 6:
+            right -= 1
+        rows = range(n-1, -1, -1) if upward else range(n)
+        for r in rows:
+            for c in (right, right-1):
+                if not res[r, c]:
+                    order.append(r*n + c)
+        upward = not upward
+
+    return np.array(order, dtype=np.intp)
+
+@lru_cache(maxsize=None)
+def _mask_patterns(ver):
+    # all 8 standard mask patterns, limited to data modules: shape (8, n, n)
+    n = version_size(ver)
+    _, res = _template(ver)
+    r, c = np.indices((n, n))
+
+    pats = np.array([
+        (r + c) % 2 == 0,
+        r % 2 == 0,
+        c % 3 == 0,
+        (r + c) % 3 == 0,
+        ((r // 2) + (c // 3)) % 2 == 0,
+        ((r * c) % 2) + ((r * c) % 3) == 0,
+        (((r * c) % 2) + ((r * c) % 3)) % 2 == 0,
+        (((r + c) % 2) + ((r * c) % 3)) % 2 == 0,
+    ])
+
+    return (pats & ~res).astype(np.uint8)
+
+@lru_cache(maxsize=None)
+def _format_layers():
+    # format info modules for each mask, as (8, 15) array of bits, LSB first
+    return np.array([[(format_bits(mk) >> k) & 1 for k in range(15)] for mk in range(8)],
+                        dtype=np.uint8)
+
+def data_codewords(data, ver):
+    # bit stream for the alphanumeric text, with terminator and padding, as bytes (numpy)
+    ec, b1, d1, b2, d2 = ECC_BLOCKS_L[ver]
+    capacity = (b1 * d1) + (b2 * d2)
+
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    vals = _ALNUM_LOOKUP[np.frombuffer(data, dtype=np.uint8)]
+    assert not (vals == 255).any(), 'not alphanumeric'
+
+    count = len(vals)
+    len_bits = 9 if ver <= 9 else (11 if ver <= 26 else 13)
+
+    # pairs of chars into 11 bits, odd char at end into 6 bits
+    pairs = vals[0:count & ~1].astype(np.uint16).reshape(-1, 2)
+    pairs = (pairs[:, 0] * 45) + pairs[:, 1]
+    chunks = [_bits(0b0010, 4), _bits(count, len_bits), _bits(pairs, 11)]
+    if count % 2:
+        chunks.append(_bits(vals[-1], 6))
+
+    bits = np.concatenate(chunks)
+    nbits = capacity * 8
+    if len(bits) > nbits:
+        raise ValueError('Data will not fit in this version')
+
+    # terminator (up to 4 zeros), then zeros to byte boundary
+    used = min(len(bits) + 4, nbits)
+    used += (-used) % 8
+    out = np.zeros(capacity, dtype=np.uint8)
+    nb = used // 8
+    out[0:nb] = np.packbits(np.concatenate([bits, np.zeros(used - len(bits), dtype=np.uint8)]))
+
+    # pad bytes
+    out[nb:] = np.resize(np.array([0xec, 0x11], dtype=np.uint8), capacity - nb)
+
+    return out
+
+def _bits(values, width):
+    # big-endian bits of each of the values, each as width bits: flat array
+    v = np.atleast_1d(np.asarray(values, dtype=np.uint32))
+    shifts = np.arange(width-1, -1, -1, dtype=np.uint32)
+    return ((v[:, None] >> shifts) & 1).astype(np.uint8).ravel()
+
+def add_ecc(data, ver):
+    # split into blocks, compute RS codes, and interleave; returns all codewords
+    ec, b1, d1, b2, d2 = ECC_BLOCKS_L[ver]
+    nblk = b1 + b2
+    width = max(d1, d2)
+
+    # data blocks; shorter blocks have a leading zero (harmless for division)
+    # and missing trailing position (for interleave)
+    blocks = np.zeros((nblk, width), dtype=np.uint8)
+    blocks[0:b1, width-d1:] = data[0:b1*d1].reshape(b1, d1)
+    if b2:
+        blocks[b1:, width-d2:] = data[b1*d1:].reshape(b2, d2)
+
+    # polynomial long division, all blocks at once
+    gen = _generator(ec)[1:]
+    rem = np.zeros((nblk, width + ec), dtype=np.uint8)
+    rem[:, 0:width] = blocks
+    for i in range(width):
+        rem[:, i+1:i+1+ec] ^= _GF_MUL[rem[:, i:i+1], gen[None, :]]
+    ecc = rem[:, width:]
+
+    # interleave data: column by column, skipping absent positions
+    inter = np.zeros((nblk, width), dtype=np.uint8)
+    present = np.ones((nblk, width), dtype=bool)
+    inter[0:b1, 0:d1] = data[0:b1*d1].reshape(b1, d1)
+    present[0:b1, d1:] = False
+    if b2:
+        inter[b1:, 0:d2] = data[b1*d1:].reshape(b2, d2)
+        present[b1:, d2:] = False
+
+    return np.concatenate([inter.T[present.T], ecc.T.ravel()])
+
+def penalties(cands):
+    # Penalty score for each candidate (k, n, n), same rules/quirks as pyqrcode.
+    k, n, _ = cands.shape
+    scores = np.zeros(k, dtype=np.int64)
+
+    both = (cands, cands.transpose(0, 2, 1))
+
+    # rule 1: runs of 5+ same color, in rows and columns: 3 + (len - 5)
+    for a in both:
+        edge = np.ones(a.shape, dtype=bool)
+        edge[:, :, 1:] = a[:, :, 1:] != a[:, :, :-1]
+        starts = np.flatnonzero(edge)
+        lens = np.diff(np.append(starts, a.size))
+        pen = np.where(lens >= 5, lens - 2, 0)
+        scores += np.bincount(starts // (n*n), weights=pen, minlength=k).astype(np.int64)
+
+    # rule 2: 2x2 blocks of same color
+    a = cands
+    same = ((a[:, :-1, :-1] == a[:, 1:, :-1])
+                & (a[:, :-1, :-1] == a[:, :-1, 1:])
+                & (a[:, :-1, :-1] == a[:, 1:, 1:]))
+    scores += 3 * same.sum(axis=(1, 2))
+
+    # rule 3: finder-like 1011101 with four light on one side (in bounds only)
+    for a in both:
+        win = np.zeros((k, n, n-10), dtype=np.uint16)
+        for j in range(11):
+            win = (win << 1) | a[:, :, j:n-10+j]
+        hits = (win == 0b00001011101) | (win == 0b10111010000)
+        scores += 40 * hits.sum(axis=(1, 2))
+
+    # rule 4: balance of dark vs. light (pyqrcode's integer rounding)
+    for i, nblack in enumerate(cands.sum(axis=(1, 2), dtype=np.int64)):
+        percent = ((int(nblack) / (n*n)) * 100) - 50
+        scores[i] += int((abs(int(percent)) / 5) * 10)
+
+    return scores
+
+def encode_qr(data, ver, mask=None):
+    # Build QR for alphanumeric text, at ECC level L, in indicated version.
+    # - returns square uint8 array of 0/1 (1=dark), no quiet zone
+    # - picks best mask (by penalty score), unless one is given
+    assert 1 <= ver <= 40
+
+    n = version_size(ver)
+    base, _ = _template(ver)
+    path = _data_path(ver)
+
+    words = add_ecc(data_codewords(data, ver), ver)
+    bits = np.unpackbits(words)
+
+    # remainder bits are zero
+    flat = base.ravel().copy()
+    flat[path[0:len(bits)]] = bits[0:len(path)]
+    placed = flat.reshape(n, n)
+
+    masks = range(8) if mask is None else [mask]
+
+    cands = placed[None, :, :] ^ _mask_patterns(ver)[list(masks)]
+    _place_format_for(cands, n, masks)
+
+    if mask is None:
+        best = int(np.argmin(penalties(cands)))
+        return cands[best]
+
+    return cands[0]
+
+def _place_format_for(cands, n, masks):
+    # write format info for indicated masks into candidates
+    fb = _format_layers()[list(masks)][:, ::-1]         # MSB first
+
+    # around top-left finder: row 8 left-to-right, then column 8 upwards
+    cands[:, 8, [0, 1, 2, 3, 4, 5, 7, 8]] = fb[:, 0:8]
+    cands[:, [7, 5, 4, 3, 2, 1, 0], 8] = fb[:, 8:15]
+
+    # second copy: column 8 upwards from bottom, then row 8 across top-right
+    cands[:, [n-1, n-2, n-3, n-4, n-5, n-6, n-7], 8] = fb[:, 0:7]
+    cands[:, 8, n-8:] = fb[:, 7:15]
+
+# EOF
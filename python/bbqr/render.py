@@ -0,0 +1,417 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - builds QR images for a series of parts
+# - slow work (QR construction and image conversion) can be spread over a pool
+#   of worker processes; results always come back in order of the parts given
+# - when numpy is installed, our own QR encoder (see qr.py) is used, and
+#   pyqrcode is only needed for terminal output
+#
+import io, os
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from .stats import stage
+
+try:
+    import numpy as np
+    from . import qr
+except ImportError:
+    # slow path: pyqrcode does everything
+    np = qr = None
+
+def num_jobs(jobs):
+    # how many worker processes to use: zero/None means one per CPU
+    return jobs or os.cpu_count() or 1
+
+def pool_map(fn, arg_lists, jobs=1):
+    # call fn over zipped arg lists, maybe in a process pool, keeping order
+    # - fn must be a module-level function, so it can be pickled
+    count = len(arg_lists[0])
+    jobs = min(num_jobs(jobs), count)
+
+    if jobs <= 1:
+        return list(map(fn, *arg_lists))
+
+    # few large batches per worker, to limit IPC overhead
+    chunksize = max(1, count // (jobs * 4))
+
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        return list(ex.map(fn, *arg_lists, chunksize=chunksize))
+
+def make_qr(part, vers):
+    # just the QR code (pyqrcode object)
+    import pyqrcode
+    return pyqrcode.create(part, error='L', version=vers, mode='alphanumeric')
+
+def make_matrix(part, vers):
+    # QR modules as rows of 0/1 (1=dark), no quiet zone
+    # - numpy array if we have our own encoder, else list of lists
+    if qr:
+        return qr.encode_qr(part, vers)
+
+    return make_qr(part, vers).code
+
+def matrix_image(mat, scale=4, quiet_zone=10):
+    # PIL image (mode L) for QR matrix: black modules on white
+    from PIL import Image
+
+    if np is None:
+        n = len(mat)
+        img = Image.new('L', (n, n))
+        img.putdata([0 if b else 255 for row in mat for b in row])
+        img = img.resize((n*scale, n*scale), Image.NEAREST)
+
+        rv = Image.new('L', ((n + 2*quiet_zone) * scale, ) * 2, 255)
+        rv.paste(img, (quiet_zone * scale, ) * 2)
+        return rv
+
+    px = np.where(np.pad(mat, quiet_zone), 0, 255).astype(np.uint8)
+    px = px.repeat(scale, axis=0).repeat(scale, axis=1)
+
+    return Image.fromarray(px, 'L')
+
+def matrix_svg(mat, scale=4, quiet_zone=4):
+    # SVG document (bytes) for QR matrix, same layout as pyqrcode makes:
+    # a single path, with a horizontal line for each run of dark modules
+    size = (len(mat) * scale) + (2 * quiet_zone * scale)
+
+    rv = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+          f'<svg xmlns="http://www.w3.org/2000/svg" height="{size}" width="{size}" class="pyqrcode">',
+          '<path' + (f' transform="scale({scale})"' if scale != 1 else ''),
+          ' stroke="#000" class="pyqrline" d="']
+
+    # pen position, relative moves after the first
+    x, y = -quiet_zone, quiet_zone - .5
+    first = True
+    for row in mat:
+        y += 1
+        row = list(row)
+        col = 0
+        while col < len(row):
+            if not row[col]:
+                col += 1
+                continue
+
+            start = col
+            while col < len(row) and row[col]:
+                col += 1
+
+            rv.append(f"{'M' if first else 'm'}{start - x} {y}h{col - start}")
+            x, y = col, 0
+            first = False
+
+    rv.append('"/></svg>\n')
+
+    return ''.join(rv).encode('utf-8')
+
+# palette for frames: white background, black modules, grey for progress bar
+WHITE, BLACK, GREY = 0, 1, 2
+PALETTE = [255, 255, 255,  0, 0, 0,  128, 128, 128]
+
+def bar_geometry(width, scale, num_parts):
+    # progress bar: (left margin, width per part, top row, height) in pixels
+    pw = width // num_parts
+    lm = (width - (pw * num_parts)) // 2
+    h = scale//2
+    y = width - h - (scale//2) - 1
+
+    return lm, pw, y, h
+
+@lru_cache(maxsize=8)
+def frame_template(n, scale=4, quiet_zone=10, num_parts=1):
+    # Palette indexes for what every frame of an animation has in common:
+    # white quiet zone, and progress bar all in grey. Read only; copy it.
+    width = (n + 2*quiet_zone) * scale
+    rv = np.full((width, width), WHITE, dtype=np.uint8)
+
+    if num_parts > 1:
+        lm, pw, y, h = bar_geometry(width, scale, num_parts)
+        rv[y:y+h+1, lm:lm+(num_parts*pw)+1] = GREY
+
+    rv.flags.writeable = False
+    return rv
+
+def frame_image(mat, scale=4, idx=0, num_parts=1, quiet_zone=10):
+    # PIL image (palette mode) of QR matrix, with progress bar if needed
+    # - one array copy of shared template, then modules and current bar segment dropped in
+    from PIL import Image
+
+    mat = np.asarray(mat, dtype=np.uint8)
+    n = len(mat)
+    px = frame_template(n, scale, quiet_zone, num_parts).copy()
+
+    # module values are also palette indexes: 0=white 1=black
+    q = quiet_zone * scale
+    px[q:q+(n*scale), q:q+(n*scale)] = mat.repeat(scale, axis=0).repeat(scale, axis=1)
+
+    if num_parts > 1:
+        # current part: black; rest of bar stays grey
+        lm, pw, y, h = bar_geometry(len(px), scale, num_parts)
+        right = lm + ((idx+1) * pw) + (1 if idx == num_parts-1 else 0)
+        px[y:y+h+1, lm+(idx*pw):right] = BLACK
+
+    img = Image.fromarray(px, 'P')
+    img.putpalette(PALETTE)
+
+    return img
+
+def make_image(part, vers, scale=4, idx=0, num_parts=1):
+    # build PIL image for one part, with progress bar if needed
+    if np is not None:
+        return frame_image(make_matrix(part, vers), scale, idx, num_parts)
+
+    # slow path, w/o numpy
+    from PIL import ImageDraw
+
+    img = matrix_image(make_matrix(part, vers), scale=scale)
+
+    if num_parts > 1:
+        # add progress bar
+        lm, pw, y, h = bar_geometry(img.width, scale, num_parts)
+        draw = ImageDraw.Draw(img)
+
+        for j in range(num_parts):
+            draw.rectangle( (lm+(j * pw), y, lm+((j+1)*pw), y+h), fill=(128 if idx != j else 0))
+
+    return img
+
+def make_svg(part, vers, scale=4):
+    # SVG file contents (bytes) for one part; no progress bar
+    return matrix_svg(make_matrix(part, vers), scale=scale)
+
+def render_images(parts, vers, scale=4, jobs=1):
+    # build PIL images for all parts (in order), using jobs processes
+    n = len(parts)
+    return pool_map(make_image, [parts, [vers]*n, [scale]*n, range(n), [n]*n], jobs)
+
+def render_svgs(parts, vers, scale=4, jobs=1):
+    # build SVG contents for all parts (in order), using jobs processes
+    n = len(parts)
+    return pool_map(make_svg, [parts, [vers]*n, [scale]*n], jobs)
+
+def dark_runs(mat):
+    # (row, start col, end col) for each horizontal run of dark modules
+    if np is not None:
+        # pad each row with light modules, then runs start/end where value changes
+        mat = np.asarray(mat, dtype=np.int8)
+        n, w = mat.shape
+        edges = np.diff(np.pad(mat, ((0, 0), (1, 1))).ravel())
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        return zip((starts // (w+2)).tolist(), (starts % (w+2)).tolist(),
+                        (ends % (w+2)).tolist())
+
+    rv = []
+    for y, row in enumerate(mat):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                rv.append((y, start, x))
+            x += 1
+    return rv
+
+def runs_path(runs, quiet_zone=4):
+    # SVG path data: horizontal line (stroke 1 wide) along middle of each run
+    # - moves are relative, after the first
+    rv = []
+    px, py = None, None
+    for y, start, end in runs:
+        x, y = start + quiet_zone, y + quiet_zone + .5
+        if px is None:
+            rv.append(f'M{x} {y}h{end - start}')
+        else:
+            dy = y - py
+            rv.append(f'm{x - px} {dy:g}h{end - start}')
+        px, py = x + (end - start), y
+
+    return ''.join(rv)
+
+def animated_svg(mats, scale=4, frame_delay=250, quiet_zone=5):
+    # One SVG document (bytes) showing QR matrices in turn, with progress bar
+    # - modules dark in every frame (finders, timing, etc) are drawn once, then each
+    #   frame is a single path of what's left; CSS animation shows one frame at a time
+    # - progress bar is in the bottom row of the quiet zone (so keep it >= 5 modules)
+    mats = [np.asarray(m, dtype=bool) for m in mats] if np is not None else mats
+    count = len(mats)
+    n = len(mats[0])
+    size = n + (2 * quiet_zone)
+
+    if np is not None:
+        common = np.logical_and.reduce(mats)
+        frames = [m & ~common for m in mats]
+    else:
+        common = [[all(m[y][x] for m in mats) for x in range(n)] for y in range(n)]
+        frames = [[[b and not c for b, c in zip(row, crow)] for row, crow in zip(m, common)]
+                        for m in mats]
+
+    rv = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+          f'<svg xmlns="http://www.w3.org/2000/svg" height="{size*scale}" width="{size*scale}"'
+          f' viewBox="0 0 {size} {size}" class="bbqr">']
+
+    if count == 1:
+        # nothing to animate
+        rv.append(f'<path stroke="#000" d="{runs_path(dark_runs(mats[0]), quiet_zone)}"/>')
+        rv.append('</svg>\n')
+        return ''.join(rv).encode('utf-8')
+
+    # each frame is visible for first 1/count of cycle, starting at its own delay;
+    # black segment of progress bar steps along the grey bar
+    cycle = count * frame_delay
+    pw = size / count
+    rv.append('<style>'
+        f'.f{{visibility:hidden;animation:bbqr-f {cycle}ms step-end infinite}}'
+        f'@keyframes bbqr-f{{0%{{visibility:visible}}{100/count:.6g}%{{visibility:hidden}}}}'
+        f'.b{{animation:bbqr-b {cycle}ms steps({count}) infinite}}'
+        f'@keyframes bbqr-b{{to{{transform:translateX({size}px)}}}}'
+        '</style>')
+
+    rv.append(f'<g stroke="#000"><path d="{runs_path(dark_runs(common), quiet_zone)}"/>')
+    for i, m in enumerate(frames):
+        delay = f' style="animation-delay:{i*frame_delay}ms"' if i else ''
+        rv.append(f'<path class="f"{delay} d="{runs_path(dark_runs(m), quiet_zone)}"/>')
+
+    y = size - .5
+    rv.append(f'<path stroke="#888" stroke-width=".5" d="M0 {y}h{size}"/>')
+    rv.append(f'<path class="b" stroke-width=".5" d="M0 {y}h{pw:.6g}"/>')
+    rv.append('</g></svg>\n')
+
+    return ''.join(rv).encode('utf-8')
+
+def make_animated_svg(parts, vers, scale=4, frame_delay=250, jobs=1):
+    # single SVG file (bytes) cycling through all parts; see animated_svg()
+    n = len(parts)
+    mats = pool_map(make_matrix, [parts, [vers]*n], jobs)
+    return animated_svg(mats, scale=scale, frame_delay=frame_delay)
+
+def _lzw(px):
+    # GIF image data (LZW, 2-bit minimum code size, as sub-blocks) for 2D array
+    # of palette indexes
+    # - pillow's own GIF writer always uses 8-bit codes, even for a 4-colour palette
+    from PIL import Image
+
+    img = Image.fromarray(np.ascontiguousarray(px), 'P')
+    enc = Image._getencoder('P', 'gif', 'P', (2, 0))
+    try:
+        enc.setimage(img.im, (0, 0) + img.size)
+        rv = []
+        while True:
+            _, err, data = enc.encode(0x10000)
+            rv.append(data)
+            if err:
+                break
+        assert err > 0, f'LZW encoder error: {err}'
+    finally:
+        enc.cleanup()
+
+    return b''.join(rv)
+
+def gif_file(frames, frame_delay=250):
+    # Animated GIF (bytes) of frames: PIL palette images or arrays (see frame_image)
+    # - 4-entry colour table, so 2-bit LZW codes
+    # - after the first frame, only the rectangle that changed is stored and the
+    #   rest of the previous frame is left in place: quiet zone is never repeated
+    u16 = lambda n: int(n).to_bytes(2, 'little')
+
+    frames = [np.asarray(f) for f in frames]
+    h, w = frames[0].shape
+    delay = u16(round(frame_delay / 10))        # in 1/100ths of second
+
+    rv = [b'GIF89a', u16(w), u16(h), bytes([0x91, WHITE, 0]),
+            bytes(PALETTE + [255, 255, 255] * (4 - len(PALETTE)//3))]
+
+    if len(frames) > 1:
+        # loop forever
+        rv.append(b'!\xff\x0bNETSCAPE2.0\x03\x01' + u16(0) + b'\0')
+
+    for i, px in enumerate(frames):
+        x = y = 0
+        if i:
+            changed = (px != frames[i-1])
+            rows = np.flatnonzero(changed.any(axis=1))
+            cols = np.flatnonzero(changed.any(axis=0))
+            if len(rows):
+                y, x = rows[0], cols[0]
+                px = px[y:rows[-1]+1, x:cols[-1]+1]
+            else:
+                px = px[0:1, 0:1]
+
+        # graphic control: delay, and "do not dispose" (disposal method 1)
+        rv.append(b'!\xf9\x04\x04' + delay + b'\0\0')
+        rv.append(b',' + u16(x) + u16(y) + u16(px.shape[1]) + u16(px.shape[0]) + b'\0\x02')
+
+        rv.append(_lzw(px) + b'\0')
+
+    rv.append(b';')
+
+    return b''.join(rv)
+
+def _gif_matches(data, frames):
+    # does GIF file read back (by pillow) as these frames? Decoding the last one
+    # goes through all before it, so bad LZW data anywhere would show.
+    from PIL import Image
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.size != frames[-1].size or getattr(img, 'n_frames', 1) != len(frames):
+            return False
+        img.seek(len(frames) - 1)
+        return img.convert('L').tobytes() == frames[-1].convert('L').tobytes()
+    except (OSError, ValueError, EOFError, SyntaxError):
+        return False
+
+# image formats for image_file(): PIL format name, and save() options for animation
+IMAGE_FORMATS = {
+    'png': ('png', dict(default_image=False)),
+    'apng': ('png', dict(default_image=False)),
+    'gif': ('gif', dict()),
+    'webp': ('webp', dict(lossless=True, method=1)),
+}
+
+def image_file(parts, vers, fmt='gif', scale=4, frame_delay=250, jobs=1, stats=None,
+                optimize=True):
+    # contents of PNG/APNG/GIF/WebP file (bytes) showing all parts: animated if more than one
+    # - png/apng are the same thing: animated PNG when more than one part
+    # - optimize: for GIF, use our smaller & faster writer (needs numpy), see gif_file();
+    #   falls back to pillow's writer if that fails, or its file doesn't read back right
+    # - stats: optional Stats object (see stats.py)
+    assert fmt in IMAGE_FORMATS, f'unsupported image format: {fmt}'
+    pil_fmt, kws = IMAGE_FORMATS[fmt]
+
+    with stage(stats, 'render', sum(len(p) for p in parts) if stats else 0):
+        frames = render_images(parts, vers, scale=scale, jobs=jobs)
+
+    with stage(stats, 'save') as st:
+        rv = None
+        if fmt == 'gif' and optimize and np is not None:
+            try:
+                rv = gif_file(frames, frame_delay)
+            except (AttributeError, TypeError, ValueError, OSError, AssertionError):
+                # pillow internals we use (see _lzw) are missing or changed:
+                # its own writer still works, just bigger and slower
+                rv = None
+
+            if rv is not None and not _gif_matches(rv, frames):
+                # changed quietly: don't trust it
+                rv = None
+
+        if rv is None:
+            if pil_fmt == 'webp':
+                # lossless WebP is always RGB(A)
+                frames = [f.convert('RGB') for f in frames]
+
+            out = io.BytesIO()
+            if len(frames) == 1:
+                frames[0].save(out, format=pil_fmt, **kws)
+            else:
+                frames[0].save(out, format=pil_fmt, save_all=True, loop=0,
+                        duration=frame_delay, append_images=frames[1:], **kws)
+            rv = out.getvalue()
+
+        if st: st.bytes_out = len(rv)
+
+    return rv
+
+# EOF
@@ -0,0 +1,95 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - plan the split for fastest scanning, rather than fewest QR codes
+# - bigger QR versions pack more data per frame, but phone cameras miss
+#   more of them; smaller versions need more frames, each shown for frame_delay
+# - model: animation loops forever, each frame is shown for frame_delay and
+#   the camera gets fps*frame_delay tries at it, each succeeding with a
+#   probability that depends only on QR version
+#
+from collections import namedtuple
+from .consts import version_size
+from .split import num_qr_needed
+
+def phone_success(ver):
+    # Rough chance a typical phone camera reads one QR of this version on one try.
+    # - near certain for small codes, falling off as modules get finer
+    size = version_size(ver)
+    return min(0.99, 1.0 - 0.8 * ((size - 21) / (177 - 21)) ** 2)
+
+# camera frames per second; success: callable, dict or sequence indexed by version;
+# frame_delay: seconds each part is shown
+ScannerModel = namedtuple('ScannerModel', 'fps success frame_delay')
+ScannerModel.__new__.__defaults__ = (phone_success, 0.25)
+
+def success_chance(model, ver):
+    # chance of reading a QR of this version, on one camera frame
+    return model.success(ver) if callable(model.success) else model.success[ver]
+
+def read_chance(model, ver):
+    # probability of reading a frame at least once, during one showing of it
+    p = success_chance(model, ver)
+    tries = model.fps * model.frame_delay
+    if tries < 1:
+        # camera may not even see this frame
+        return tries * p
+
+    return 1.0 - (1.0 - p) ** tries
+
+def expected_loops(num_qr, q):
+    # expected number of times the animation must play, until every one
+    # of num_qr frames was read (each read with chance q, per showing)
+    # - E[max of num_qr geometric variables] = sum over r >= 0 of P(max > r)
+    if q >= 1:
+        return 1.0
+    assert q > 0, 'cannot ever be read'
+
+    rv = 0.0
+    miss = 1.0          # (1-q)^r
+    while 1:
+        term = 1.0 - (1.0 - miss) ** num_qr
+        rv += term
+        if term < 1e-9:
+            return rv
+        miss *= (1.0 - q)
+
+def expected_scan_time(model, ver, num_qr):
+    # expected seconds to read all parts, with the scanner described
+    # - whole loops of animation are counted, so it's a bit pessimistic
+    if num_qr == 1:
+        # not animated: camera retries until it works
+        return 1.0 / (model.fps * success_chance(model, ver))
+
+    return num_qr * model.frame_delay * expected_loops(num_qr, read_chance(model, ver))
+
+def find_fastest_version(ll, split_mod, model, min_split=1, max_split=1295,
+                            min_version=5, max_version=40):
+    # Like find_best_version(), but picks version (and so number of QR)
+    # with lowest expected_scan_time() for model; ties go to fewer QR, lower version.
+    # - versions the model can never read are skipped
+    # - returns (version, number of QR, chars per part)
+    min_version = min(min_version, max_version)
+
+    assert 1 <= min_version <= max_version <= 40, "min/max version out of range"
+    assert 1 <= min_split <= max_split <= 1295, "num splits out of range"
+
+    best = None
+    for ver in range(min_version, max_version+1):
+        count, per_each = num_qr_needed(ver, ll, split_mod)
+        if not (min_split <= count <= max_split):
+            continue
+        if read_chance(model, ver) <= 0:
+            # this camera never reads it
+            continue
+
+        key = (expected_scan_time(model, ver, count), count, ver)
+        if not best or key < best[0]:
+            best = key, (ver, count, per_each)
+
+    if not best:
+        raise ValueError("Cannot make it fit")
+
+    return best[1]
+
+# EOF
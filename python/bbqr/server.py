@@ -0,0 +1,264 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - long-running local HTTP service, so integrations don't pay to start python
+#   (and import everything) for each split or join
+# - slow work runs on a fixed pool of worker processes, started (and warmed up) once
+# - limited number of requests in progress at once; the rest get "503 Busy"
+#
+#   POST /split?type=P&encoding=Z&max_version=20&min_split=1&format=text
+#           body is data to send; format: text (default), json, png, apng, gif, webp,
+#           or svg (animated, or just one QR with part=N)
+#   POST /join/SESSION
+#           body is one or more scanned parts, one per line. Replies with progress
+#           (JSON, status 202) until complete, then the data itself (status 200)
+#   DELETE /join/SESSION
+#   GET /stats
+#           latency histogram (per endpoint) and counters, as JSON
+#
+import json, time, threading
+from bisect import bisect_left
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as PoolTimeout
+from .split import split_qrs
+from .join import BBQrJoiner, join_qrs
+from .render import num_jobs
+from .utils import detect_filetype
+
+# upper limits of histogram buckets, in milliseconds (last is everything slower)
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+IMAGE_TYPES = dict(png='image/png', apng='image/apng', gif='image/gif', webp='image/webp',
+                        svg='image/svg+xml')
+
+class LatencyHistogram:
+    # count of requests by how long they took, per endpoint; thread safe
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def add(self, route, secs):
+        ms = secs * 1000.0
+        with self.lock:
+            r = self.routes.setdefault(route, dict(count=0, sum_ms=0.0, max_ms=0.0,
+                                                        counts=[0] * (len(self.buckets) + 1)))
+            r['count'] += 1
+            r['sum_ms'] += ms
+            r['max_ms'] = max(r['max_ms'], ms)
+            r['counts'][bisect_left(self.buckets, ms)] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return dict(buckets_ms=list(self.buckets),
+                        routes={k: dict(v, counts=list(v['counts'])) for k, v in self.routes.items()})
+
+def _warm_up():
+    # runs once in each worker process: do the imports now, not on first request
+    from . import render
+    if render.qr:
+        render.qr._template(10)
+
+def split_job(raw, type_code, fmt='text', scale=4, frame_delay=250, part=None, **kws):
+    # runs in worker: returns (content type, body)
+    vers, parts = split_qrs(raw, type_code, **kws)
+
+    if fmt == 'text':
+        return 'text/plain', ('\n'.join(parts) + '\n').encode('ascii')
+
+    if fmt == 'json':
+        return 'application/json', json.dumps(dict(version=vers, parts=parts)).encode('ascii')
+
+    from . import render
+
+    if fmt == 'svg':
+        if part is None:
+            return IMAGE_TYPES[fmt], render.make_animated_svg(parts, vers, scale=scale,
+                                                                frame_delay=frame_delay)
+        return IMAGE_TYPES[fmt], render.make_svg(parts[part], vers, scale=scale)
+
+    return IMAGE_TYPES[fmt], render.image_file(parts, vers, fmt, scale=scale,
+                                                    frame_delay=frame_delay)
+
+def join_job(parts):
+    # runs in worker: returns (file_type, raw)
+    return join_qrs(parts)
+
+class BBQrServer(ThreadingHTTPServer):
+    # - jobs: worker processes (0 for one per CPU)
+    # - max_concurrent: requests handled at once, others are refused (503)
+    # - timeout: seconds to wait for a worker's result (504 after that)
+    # - sessions for /join are dropped after max_age seconds without a new part
+    daemon_threads = True
+
+    def __init__(self, addr, jobs=0, max_concurrent=None, timeout=30,
+                    max_sessions=1000, max_age=300, verbose=False):
+        super().__init__(addr, BBQrHandler)
+
+        jobs = num_jobs(jobs)
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=_warm_up)
+        self.slots = threading.BoundedSemaphore(max_concurrent or (2 * jobs))
+        self.timeout = timeout
+        self.verbose = verbose
+
+        self.sessions = {}          # id => [joiner, last used]
+        self.max_sessions = max_sessions
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+        self.latency = LatencyHistogram()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def run(self, fn, *args, **kws):
+        # do work in pool, wait for result
+        return self.pool.submit(fn, *args, **kws).result(timeout=self.timeout)
+
+    def joiner(self, sid):
+        # find/create session, dropping stale ones
+        now = time.monotonic()
+        with self.lock:
+            for k in [k for k, s in self.sessions.items() if now - s[1] > self.max_age]:
+                del self.sessions[k]
+
+            sess = self.sessions.get(sid)
+            if not sess:
+                if len(self.sessions) >= self.max_sessions:
+                    raise OverflowError('too many sessions')
+                sess = self.sessions[sid] = [BBQrJoiner(defer=True), now]
+
+            sess[1] = now
+            return sess[0]
+
+    def stats(self):
+        return dict(latency=self.latency.as_dict(), in_flight=self.in_flight,
+                        rejected=self.rejected, sessions=len(self.sessions))
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+class BBQrHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_one('GET')
+
+    def do_POST(self):
+        self.handle_one('POST')
+
+    def do_DELETE(self):
+        self.handle_one('DELETE')
+
+    def handle_one(self, method):
+        url = urlsplit(self.path)
+        route = url.path.strip('/').split('/')
+        args = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        srv = self.server
+        started = time.monotonic()
+
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if (method, route[0]) == ('GET', 'stats'):
+            # never limited, so you can see why everything else is
+            return self.reply(200, json.dumps(srv.stats()).encode('ascii'), 'application/json')
+
+        if not srv.slots.acquire(blocking=False):
+            with srv.lock:
+                srv.rejected += 1
+            return self.reply(503, b'busy\n', extra={'Retry-After': '1'})
+
+        with srv.lock:
+            srv.in_flight += 1
+        try:
+            if (method, route[0]) == ('POST', 'split') and len(route) == 1:
+                self.do_split(body, args)
+            elif route[0] == 'join' and len(route) == 2 and method in ('POST', 'DELETE'):
+                self.do_join(method, route[1], body)
+            else:
+                self.reply(404, b'not found\n')
+        except PoolTimeout:
+            self.reply(504, b'timeout\n')
+        except OverflowError as exc:
+            self.reply(503, f'{exc}\n'.encode('utf-8'))
+        except Exception as exc:
+            # bad input: split/join use asserts and ValueError
+            self.reply(400, f'{type(exc).__name__}: {exc}\n'.encode('utf-8'))
+        finally:
+            with srv.lock:
+                srv.in_flight -= 1
+            srv.slots.release()
+            srv.latency.add(route[0] if route[0] in ('split', 'join') else 'other',
+                                time.monotonic() - started)
+
+    def do_split(self, raw, args):
+        type_code = args.pop('type', None)
+        if not type_code:
+            type_code, raw = detect_filetype('', raw)
+
+        fmt = args.pop('format', 'text')
+        assert fmt in ('text', 'json') or fmt in IMAGE_TYPES, f'bad format: {fmt}'
+
+        for k in ('max_version', 'min_split', 'max_split', 'min_version', 'scale',
+                        'frame_delay', 'part'):
+            if k in args:
+                args[k] = int(args[k])
+        assert set(args) <= {'encoding', 'max_version', 'min_split', 'max_split',
+                                'min_version', 'scale', 'frame_delay', 'part'}, 'unknown args'
+
+        ctype, rv = self.server.run(split_job, raw, type_code, fmt, **args)
+        self.reply(200, rv, ctype)
+
+    def do_join(self, method, sid, body):
+        srv = self.server
+
+        if method == 'DELETE':
+            with srv.lock:
+                found = srv.sessions.pop(sid, None)
+            return self.reply(200 if found else 404, b'')
+
+        j = srv.joiner(sid)
+        with srv.lock:
+            try:
+                for ln in body.decode('ascii').split():
+                    j.add(ln)
+            except Exception:
+                # garbage, or different series: start over next time
+                srv.sessions.pop(sid, None)
+                raise
+
+        if not j.have_all:
+            seen, total = j.progress
+            prog = dict(seen=seen, total=total, missing=sorted(j.missing))
+            return self.reply(202, json.dumps(prog).encode('ascii'), 'application/json')
+
+        with srv.lock:
+            srv.sessions.pop(sid, None)
+
+        parts = [j.data[i] for i in range(j.num_parts)]
+        file_type, raw = srv.run(join_job, parts)
+        self.reply(200, raw, 'application/octet-stream', {'X-BBQr-File-Type': file_type})
+
+    def reply(self, code, body, ctype='text/plain', extra={}):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in extra.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+def serve(host='127.0.0.1', port=8080, **kws):
+    # run until interrupted; see BBQrServer for kw args
+    with BBQrServer((host, port), **kws) as srv:
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+# EOF
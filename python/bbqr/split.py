@@ -1,7 +1,7 @@
 #
 # (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
 #
-# - uses pyqrcode for deep QR knowledge
+# - uses built-in QR capacity table (see consts.py) for deep QR knowledge
 # - text prefix on each QR:
 #
 #       B$                  fixed header for this protocol (2 chars)
@@ -10,9 +10,15 @@
 #       05                  2-digits of HEX: total number of QR codes
 #       00                  2-digits of HEX: which QR code this is in the sequence
 #
+import io
 from math import ceil
-from .utils import version_to_chars, encode_data, int2base36
+from functools import lru_cache, partial
+from collections import namedtuple
+from .utils import version_to_chars, encode_data, int2base36, deflate_default
+from .utils import read_chunks, compress_chunks, rechunk, b32_encode
+from .utils import compress_data, encoded_size, encode_parts
 from .consts import HEADER_LEN, KNOWN_FILETYPES
+from .stats import stage
 
 def num_qr_needed(ver, ll, split_mod):
     # Determine number of QR's at indicated version would be
@@ -34,58 +40,247 @@ def num_qr_needed(ver, ll, split_mod):
 
     return (need if actual >= ll else (need + 1)), cap2
 
-def find_best_version(ll, split_mod, min_split=1, max_split=1295, min_version=5, max_version=40):
+def find_best_version(ll, split_mod, min_split=1, max_split=1295, min_version=5, max_version=40,
+                        stats=None):
     # Find ideal QR version and provide # of QR and splits needed.
     # - assumes you want to pack the QR, so forcing min_split means you need to have the data
     #   at least the data to fill that # of QR at min_version
+    # - number of QR needed never increases with version, so binary search is enough
+    # - memoized, since same few sizes are planned over and over
+    # - stats: optional Stats object, counts versions_tried (see stats.py)
     #
     # ll = length of encoded data to be transmitted (no headers)
     # split_mod = required size of non-runt parts so that can be decoded w/o spliting symbols
+    if stats is None:
+        return _search_version(ll, split_mod, min_split, max_split, min_version, max_version)[0:3]
 
+    with stage(stats, 'plan'):
+        rv = _search_version(ll, split_mod, min_split, max_split, min_version, max_version)
+    stats.count('versions_tried', rv[3])
+
+    return rv[0:3]
+
+@lru_cache(maxsize=4096)
+def _search_version(ll, split_mod, min_split, max_split, min_version, max_version):
+    # does the work for find_best_version(); also returns number of versions considered
     min_version = min(min_version, max_version)     # in case they spec a very low max
 
     assert 1 <= min_version <= max_version <= 40, "min/max version out of range"
     assert 1 <= min_split <= max_split <= 1295, "num splits out of range"
 
-    options = []
-    for ver in range(min_version, max_version+1):
-        count, pe = num_qr_needed(ver, ll, split_mod)
-        if not (min_split <= count <= max_split): continue
-        options.append( (ver, count, pe) )
+    tried = set()
+    def count(ver):
+        tried.add(ver)
+        return num_qr_needed(ver, ll, split_mod)[0]
 
-    # pick smallest number of QR, lowest version
-    options.sort(key=lambda v: (v[1], v[0]))
+    def lowest(lo, hi, ok):
+        # lowest version in [lo, hi] where ok() is true, assuming once true, stays true
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ok(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
 
-    if not options:
+    # versions with small enough count; then highest of those still over min_split
+    lo = lowest(min_version, max_version, lambda v: count(v) <= max_split)
+    hi = lowest(lo, max_version+1, lambda v: v > max_version or count(v) < min_split) - 1
+
+    if not (min_split <= count(lo) <= max_split) or hi < lo:
         raise ValueError("Cannot make it fit")
 
-    return options[0]
+    # pick smallest number of QR, lowest version
+    best = count(hi)
+    ver = lowest(lo, hi, lambda v: count(v) <= best)
+
+    return (ver, ) + num_qr_needed(ver, ll, split_mod) + (len(tried), )
+
+def _version_finder(scanner):
+    # version search to use, and how to rank its results
+    if not scanner:
+        return find_best_version, lambda o: 0
+
+    from .scanner import find_fastest_version, expected_scan_time
+    return partial(find_fastest_version, model=scanner), \
+                lambda o: expected_scan_time(scanner, o.version, o.count)
+
+# One way to send some data: version and count are None if it cannot fit
+SplitOption = namedtuple('SplitOption', 'encoding version count per_each encoded')
+
+def plan_split(raw, encodings='H2Z', compress=deflate_default, scanner=None, **kws):
+    # Consider each of the encodings, and what QR series each would need.
+    # - returns all options considered, best first: fewest QR, then lowest version,
+    #   then least encoded data; options that don't fit at all are last
+    # - Z is dropped when compression doesn't help (same as 2 then)
+    # - scanner: a ScannerModel, to rank by expected time to scan instead (see scanner.py)
+    # - see find_best_version() for additional kw args
+    find_version, ranking = _version_finder(scanner)
 
-def split_qrs(raw, type_code, encoding=None, **kws):
+    rv = []
+    for enc in encodings:
+        enc, encoded, split_mod = encode_data(raw, enc, compress=compress)
+        if any(o.encoding == enc for o in rv):
+            continue
+
+        try:
+            ver, count, per_each = find_version(len(encoded), split_mod, **kws)
+        except ValueError:
+            ver = count = per_each = None
+
+        rv.append(SplitOption(enc, ver, count, per_each, encoded))
+
+    rv.sort(key=lambda o: (o.count is None, ranking(o) if o.count else 0,
+                                o.count or 0, o.version or 0, len(o.encoded)))
+
+    return rv
+
+def split_qrs(raw, type_code, encoding=None, compress_search=None, search_jobs=1,
+                optimize=False, scanner=None, compress_jobs=1, stats=None, plan=None, **kws):
     # Take some bytes and yield a series of text values that 
     # can be sent as QR code.
     # - returns text
+    # - raw can be text, or anything bytes-like (ie. a memoryview of a mmap'ed file)
     # - assumes and requires alnum, L error level
+    # - compress_search: seconds to spend trying other ZLIB settings (see compress.py)
+    # - optimize: if no encoding given, pick the encoding that needs fewest QR (see plan_split)
+    # - scanner: a ScannerModel; pick version for fastest expected scan, not fewest QR
+    # - compress_jobs: threads for ZLIB compression (see parallel_deflate), zero for one per CPU
+    # - stats: optional Stats object, to collect timing of each step (see stats.py)
+    # - plan: optional list; when optimizing, filled with all the options considered
     # - see find_best_version() for additional kw args
 
     assert type_code in KNOWN_FILETYPES, f"invalid type_code: {type_code}"
     if encoding: assert encoding in 'H2Z', f"invalid encoding: {encoding}"
-    if not isinstance(raw, bytes):
-        assert isinstance(raw, str), "need binary or text"
+    if isinstance(raw, str):
         raw = raw.encode('utf-8')
+    elif not isinstance(raw, bytes):
+        # any buffer (bytearray, mmap...) works without a copy
+        raw = memoryview(raw)
 
     # perhaps compress data
-    encoding, encoded, split_mod = encode_data(raw, encoding)
+    compress = deflate_default
+    if compress_jobs != 1:
+        from .compress import parallel_deflate
+        compress = partial(parallel_deflate, jobs=compress_jobs)
+
+    if compress_search and encoding in (None, 'Z'):
+        from .compress import compress_search as search
+        with stage(stats, 'search', len(raw)) as st:
+            cmp, _ = search(raw, time_budget=compress_search, jobs=search_jobs, **kws)
+            if st: st.bytes_out = len(cmp)
+        compress = lambda _: cmp
+
+    if optimize and not encoding:
+        with stage(stats, 'plan', len(raw)):
+            options = plan_split(raw, compress=compress, scanner=scanner, **kws)
+        if plan is not None:
+            plan[:] = options
+
+        best = options[0]
+        if best.count is None:
+            raise ValueError("Cannot make it fit")
+
+        encoding, encoded, ver, num_qr, per_each = best.encoding, best.encoded, \
+                                                    best.version, best.count, best.per_each
+        ll = len(encoded)
+    else:
+        # encoded later, directly into parts
+        encoding, body = compress_data(raw, encoding, compress=compress, stats=stats)
+        encoded = None
+
+        ll, split_mod = encoded_size(encoding, len(body))
 
-    ll = len(encoded)
+        if scanner:
+            with stage(stats, 'plan'):
+                ver, num_qr, per_each = _version_finder(scanner)[0](ll, split_mod, **kws)
+        else:
+            ver, num_qr, per_each = find_best_version(ll, split_mod, stats=stats, **kws)
+
+    assert per_each * num_qr >= ll
+
+    prefix = f'B${encoding}{type_code}' + int2base36(num_qr)
+    headers = [prefix + int2base36(n) for n in range(num_qr)]
+
+    if encoded is None:
+        with stage(stats, 'encode', len(body)) as st:
+            parts = encode_parts(encoding, body, headers, per_each)
+            if st: st.bytes_out = sum(len(p) for p in parts)
+    else:
+        # already encoded by planner
+        with stage(stats, 'parts', ll) as st:
+            parts = [h + encoded[off:off+per_each] for
+                            (h, off) in zip(headers, range(0, ll, per_each))]
+            if st: st.bytes_out = sum(len(p) for p in parts)
+
+    assert len(parts) == num_qr
+
+    return ver, parts
+
+def split_qrs_iter(src, type_code, encoding=None, **kws):
+    # Like split_qrs() but parts are produced one at a time, so memory use
+    # is bounded by a single part, regardless of the size of the input.
+    # - src can be bytes, or a seekable binary file-like object (read from current position)
+    # - returns version, number of parts, and a generator for the parts themselves
+    # - when compressing, the data is read twice: once to size it, and again to encode
+    # - see find_best_version() for additional kw args
+
+    assert type_code in KNOWN_FILETYPES, f"invalid type_code: {type_code}"
+    if encoding: assert encoding in 'H2Z', f"invalid encoding: {encoding}"
+    if isinstance(src, str):
+        src = src.encode('utf-8')
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = io.BytesIO(src)
+
+    assert src.seekable(), "need seekable input"
+    start = src.tell()
+    size = src.seek(0, io.SEEK_END) - start
+    src.seek(start)
+
+    if not encoding or encoding == 'Z':
+        # Trial compression, counting bytes only; skip if it embiggens the data
+        zlen = sum(len(c) for c in compress_chunks(read_chunks(src)))
+        src.seek(start)
+
+        if zlen >= size:
+            encoding = '2'
+        else:
+            encoding = 'Z'
+            size = zlen
+
+    if encoding == 'H':
+        ll, split_mod = size * 2, 2
+    else:
+        # base32, no padding
+        ll, split_mod = ceil(size * 8 / 5), 8
 
     ver, num_qr, per_each = find_best_version(ll, split_mod, **kws)
 
     assert per_each * num_qr >= ll
 
-    return ver, [f'B${encoding}{type_code}' 
-                    + int2base36(num_qr) + int2base36(n)
-                    + encoded[off:off+per_each] for
-                            (n, off) in enumerate(range(0, ll, per_each))]
+    def gen():
+        chunks = read_chunks(src)
+        if encoding == 'Z':
+            chunks = compress_chunks(chunks)
+
+        # binary bytes needed for each part; only last part can be short
+        if encoding == 'H':
+            bpp = per_each // 2
+        else:
+            bpp = per_each * 5 // 8
+
+        prefix = f'B${encoding}{type_code}' + int2base36(num_qr)
+        n = 0
+        for n, blk in enumerate(rechunk(chunks, bpp)):
+            if encoding == 'H':
+                body = blk.hex().upper()
+            else:
+                body = b32_encode(blk)
+
+            yield prefix + int2base36(n) + body
+
+        assert n+1 == num_qr, 'input changed while reading'
+
+    return ver, num_qr, gen()
 
 # EOF
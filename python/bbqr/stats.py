@@ -0,0 +1,118 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# - optional instrumentation: where did the time (and memory) go, during split/join/render
+# - pass a Stats object as stats= to split_qrs(), join_qrs(), render.image_file()
+# - when stats is None, each stage costs one "is None" test, nothing more
+#
+import time
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+
+_NO_STATS = nullcontext()
+
+def stage(stats, name, bytes_in=0):
+    # Time a stage of work, if collecting stats. Use as:
+    #       with stage(stats, 'compress', len(raw)) as st:
+    #           ...
+    #           if st: st.bytes_out = len(result)
+    return _NO_STATS if stats is None else stats.stage(name, bytes_in)
+
+class StageStats:
+    # totals for one named stage (it may run many times)
+    __slots__ = ('calls', 'secs', 'bytes_in', 'bytes_out', 'alloc')
+
+    def __init__(self):
+        self.calls = 0
+        self.secs = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.alloc = 0          # peak bytes allocated during stage (memory=True only)
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+class _Current:
+    # what a stage reports about itself, while in progress
+    __slots__ = ('bytes_out', )
+
+    def __init__(self):
+        self.bytes_out = 0
+
+class Stats:
+    # Collects per-stage timing, byte counts and counters.
+    # - hook: called as hook(name, secs, bytes_in, bytes_out) after each stage
+    # - memory: also find peak memory allocated by each stage (tracemalloc: slow!)
+
+    def __init__(self, hook=None, memory=False):
+        self.hook = hook
+        self.memory = memory
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def stage(self, name, bytes_in=0):
+        cur = _Current()
+        started = None
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            base = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+
+        t0 = time.perf_counter()
+        try:
+            yield cur
+        finally:
+            dt = time.perf_counter() - t0
+
+            st = self.stages.get(name)
+            if st is None:
+                st = self.stages[name] = StageStats()
+            st.calls += 1
+            st.secs += dt
+            st.bytes_in += bytes_in
+            st.bytes_out += cur.bytes_out
+
+            if self.memory:
+                st.alloc = max(st.alloc, tracemalloc.get_traced_memory()[1] - base)
+                if started:
+                    tracemalloc.stop()
+
+            if self.hook:
+                self.hook(name, dt, bytes_in, cur.bytes_out)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @property
+    def compression_ratio(self):
+        # compressed size / original size, or None if nothing was compressed
+        st = self.stages.get('compress')
+        return (st.bytes_out / st.bytes_in) if st and st.bytes_in else None
+
+    def as_dict(self):
+        return dict(stages={k: v.as_dict() for k, v in self.stages.items()},
+                    counters=dict(self.counters), compression_ratio=self.compression_ratio)
+
+    def report(self):
+        # human readable table, as text
+        total = sum(st.secs for st in self.stages.values()) or 1
+        rv = [f"{'stage':12s} {'calls':>6s} {'ms':>10s} {'%':>6s} {'bytes in':>12s}"
+                f" {'bytes out':>12s}" + (f" {'alloc':>12s}" if self.memory else '')]
+        for name, st in self.stages.items():
+            rv.append(f"{name:12s} {st.calls:6d} {st.secs*1000:10.2f} {st.secs*100/total:6.1f}"
+                        f" {st.bytes_in:12d} {st.bytes_out:12d}"
+                        + (f" {st.alloc:12d}" if self.memory else ''))
+
+        if self.compression_ratio is not None:
+            rv.append(f"compression ratio: {self.compression_ratio:.3f}")
+        for k, v in self.counters.items():
+            rv.append(f"{k}: {v}")
+
+        return '\n'.join(rv)
+
+# EOF
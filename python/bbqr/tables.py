@@ -3,14 +3,11 @@
 #
 # Print a table used in the spec. Use "bbqr table" to view.
 #
-import pyqrcode
 from math import ceil, floor
 from .utils import version_to_chars
-from .consts import HEADER_LEN
+from .consts import HEADER_LEN, version_size
 
 def dump_table():
-    ver_size = pyqrcode.tables.version_size
-
     hdr = "Vers | Pixels  | Chars |  Hex |  Base32 | 2xBase32 | 5xBase32 | 10xBase32"
     print(hdr)
     print('|'.join('-'*len(i) for i in hdr.split('|')))
@@ -19,7 +16,7 @@ def dump_table():
         chars = version_to_chars(v)
         if chars < 1500 and v not in {1, 11, 14}: continue
 
-        sz = ver_size[v]
+        sz = version_size(v)
         cap = (chars - HEADER_LEN)
         bys = floor(cap / 2)       # HEX encoding
         b32 = floor((cap // 8) * 5)
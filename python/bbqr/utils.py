@@ -3,20 +3,38 @@
 #
 # - helpers and basics
 #
-import zlib
+import io, zlib, codecs
 from base64 import b32encode, b32decode
+from .consts import ALNUM_CAPACITY
+from .stats import stage
 
-def version_to_chars(v):
+# numpy version of base32 (see b32.py): imported when first needed, since numpy
+# is slow to import and small payloads never use it; None if no numpy
+b32 = False
+
+# below this many bytes, stdlib base32 is faster than setting up numpy arrays
+B32_NUMPY_MIN = 512
+
+def _b32():
+    # b32 module, or None
+    global b32
+    if b32 is False:
+        try:
+            from . import b32 as mod
+        except ImportError:
+            # no numpy: standard library does it all, just slower for big data
+            mod = None
+        b32 = mod
+
+    return b32
+
+def version_to_chars(v, ecc='L'):
     # return number of **chars** that fit into indicated version QR
-    # - assumes L for ECC
+    # - assumes L for ECC, unless told otherwise
     # - assumes alnum encoding
-    import pyqrcode
-
     assert 1 <= v <= 40
-    ecc = "L"
-    encoding = 2        # alnum
 
-    return pyqrcode.tables.data_capacity[v][ecc][encoding]
+    return ALNUM_CAPACITY[ecc][v]
 
 def int2base36(n):
     # convert an integer to two digits of base 36 string. 00 thu ZZ
@@ -29,52 +47,297 @@ def int2base36(n):
 
     return tostr(a) + tostr(b)
 
-def encode_data(raw, encoding=None):
-    # return new encoding (if we upgraded) and the
-    # characters after encoding (a string)
-    # - default is Zlib or if compression doesn't help, base32
-    # - returned data can be split, but must be done modX where X provided
+def deflate_default(raw):
+    # our standard compression: raw deflate, 1k window
+    z = zlib.compressobj(wbits=-10)
+    cmp = z.compress(raw)
+    cmp += z.flush()
+    return cmp
 
+def compress_data(raw, encoding=None, compress=deflate_default, stats=None):
+    # first half of encode_data(): return new encoding (if we upgraded) and
+    # the bytes to be encoded, which are compressed if that helped
     if encoding == 'H':
-        # Hex mode is easy.
-        return encoding, raw.hex().upper(), 2
+        return encoding, raw
 
     if not encoding or encoding == 'Z':
         # Trial compression, but skip if it embiggens the data
-        z = zlib.compressobj(wbits=-10)
-        cmp = z.compress(raw)
-        cmp += z.flush()
+        with stage(stats, 'compress', len(raw)) as st:
+            cmp = compress(raw)
+            if st: st.bytes_out = len(cmp)
+
         if len(cmp) >= len(raw):
-            encoding = '2'
+            return '2', raw
+
+        return 'Z', cmp
+
+    return encoding, raw
+
+def encoded_size(encoding, n):
+    # chars needed for n bytes, and required split points (mod), in encoding
+    if encoding == 'H':
+        return n * 2, 2
+
+    # base32, no padding
+    return (n * 8 + 4) // 5, 8
+
+def encode_data(raw, encoding=None, compress=deflate_default, stats=None):
+    # return new encoding (if we upgraded) and the
+    # characters after encoding (a string)
+    # - default is Zlib or if compression doesn't help, base32
+    # - returned data can be split, but must be done modX where X provided
+    # - compress can be replaced, but must make streams inflatable with wbits=-10
+    # - stats: optional Stats object, to get timing of each step (see stats.py)
+    encoding, raw = compress_data(raw, encoding, compress, stats)
+
+    with stage(stats, 'encode', len(raw)) as st:
+        if encoding == 'H':
+            # Hex mode is easy.
+            rv = raw.hex().upper()
         else:
-            encoding = 'Z'
-            raw = cmp
+            # Default: base32 encoding, no padding bytes
+            rv = b32_encode(raw)
+        if st: st.bytes_out = len(rv)
+
+    return encoding, rv, encoded_size(encoding, 0)[1]
+
+def encode_parts(encoding, raw, headers, per_each):
+    # Encode bytes (from compress_data) as QR parts: each of the headers, then
+    # the next per_each chars of encoded data
+    # - big base32 data is encoded straight into place (see b32.encode_parts)
+    if encoding != 'H' and len(raw) >= B32_NUMPY_MIN and _b32():
+        return b32.encode_parts(raw, headers, per_each)
+
+    enc = raw.hex().upper() if encoding == 'H' else b32_encode(raw)
+
+    return [h + enc[off:off+per_each] for h, off in zip(headers, range(0, len(enc), per_each))]
+
+def b32_encode(raw):
+    # base32 text, without padding
+    if len(raw) >= B32_NUMPY_MIN and _b32():
+        return b32.encode(raw)
+
+    return b32encode(raw).decode('ascii').rstrip('=')
+
+def read_chunks(fd, size=0x10000):
+    # yield blocks of bytes from a binary file-like object, until EOF
+    while 1:
+        blk = fd.read(size)
+        if not blk:
+            break
+        yield blk
+
+def buffer_chunks(buf, size=0x10000):
+    # yield views of a bytes-like object (no copies), in blocks
+    mv = memoryview(buf)
+    for pos in range(0, len(mv), size):
+        yield mv[pos:pos+size]
+
+def unhex_chunks(chunks):
+    # convert hex digits (whitespace ignored) into bytes, block by block
+    carry = b''
+    for blk in chunks:
+        blk = carry + bytes(blk).translate(None, b' \t\r\n\x0b\x0c')
+        cut = len(blk) & ~1
+        yield bytes.fromhex(blk[0:cut].decode('ascii'))
+        carry = blk[cut:]
+
+    if carry:
+        raise ValueError('odd number of hex digits')
+
+# bytes looked at to decide file type
+SNIFF_LEN = 4096
+
+def sniff_filetype(fname, head):
+    # guess file type code from name (may be empty) and first few bytes of the contents
+    # - returns code, and True if the data is hex which needs to be converted
+    # - ValueError if named as PSBT, but isn't one
+    head = bytes(head[0:SNIFF_LEN])
 
-    # Default: base32 encoding, no padding bytes
-    data = b32encode(raw).decode('ascii').rstrip('=')
+    if head[0:5] == b'psbt\xff':
+        # binary PSBT, whatever it's called
+        return 'P', False
 
-    return encoding, data, 8
+    if '.psb' in fname.lower():
+        if head[0:10].decode('ascii', 'replace').isprintable():
+            raise ValueError("Someone has saved Base64 or Hex encoded PSBT to disk?"
+                                " We want raw meat.")
+        raise ValueError(f"Not a PSBT: {fname}")
 
-def decode_data(parts, encoding):
+    if head[0:8] in { b'01000000', b'02000000'}:
+        # transaction in hex format
+        return 'T', True
+
+    if head[0:4] in { b'\x01\x00\x00\x00', b'\x02\x00\x00\x00'}:
+        # binary transaction
+        return 'T', False
+
+    if head[0:1] == b'{':
+        # probably JSON
+        return 'J', False
+
+    # otherwise text or binary (a char may be cut off at end)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=len(head) < SNIFF_LEN)
+        return 'U', False
+    except UnicodeError:
+        return 'B', False
+
+def detect_filetype(fname, raw):
+    # guess file type code from name and contents; returns it and maybe-converted data
+    filetype, is_hex = sniff_filetype(fname, raw)
+
+    if is_hex:
+        out = bytearray()
+        for blk in unhex_chunks(buffer_chunks(raw)):
+            out += blk
+        raw = out
+
+    return filetype, raw
+
+def compress_chunks(chunks):
+    # incremental version of compression done in encode_data()
+    z = zlib.compressobj(wbits=-10)
+    for blk in chunks:
+        cmp = z.compress(blk)
+        if cmp:
+            yield cmp
+
+    yield z.flush()
+
+def rechunk(chunks, size):
+    # regroup a series of byte blocks into exactly size-byte blocks; last may be short
+    buf = bytearray()
+    for blk in chunks:
+        buf += blk
+        if len(buf) < size:
+            continue
+
+        mv = memoryview(buf)
+        off = 0
+        while len(buf) - off >= size:
+            yield bytes(mv[off:off+size])
+            off += size
+        mv.release()
+
+        del buf[0:off]
+
+    if buf:
+        yield bytes(buf)
+
+def decode_data(parts, encoding, skip=0, stats=None):
     # give back the bytes after decoding
     # - already in order
-    # - keeps the parts separate here to validate correct split from encoder
-    if encoding == 'H':
-        return b''.join(bytes.fromhex(p) for p in parts)
+    # - skip: ignore that many chars at start of each part (ie. header)
+    # - checks parts were split on symbol boundaries by encoder, then decodes
+    #   each straight into one preallocated buffer: linear time, no repeated copies
+    # - stats: optional Stats object (see stats.py)
+    mod = 2 if encoding == 'H' else 8
+    total = 0
+    for n, p in enumerate(parts):
+        ln = len(p) - skip
+        if n != len(parts)-1:
+            assert ln % mod == 0, f'part {n} not aligned to {mod} chars'
+        total += ln
 
-    # base32 decode, but insert padding for API
-    rv = b''
-    for p in parts:
-        padding = (8 - (len(p) % 8)) % 8
-        rv += b32decode(p + (padding*'='))
+    rv = bytearray((total // 2) if encoding == 'H' else (total * 5 // 8))
+    mv = memoryview(rv)
+    off = 0
+    fast = encoding != 'H' and total * 5 >= B32_NUMPY_MIN * 8 and _b32()
+    with stage(stats, 'decode', total) as st:
+        for p in parts:
+            p = p[skip:] if skip else p
+            if fast and len(p) * 5 >= B32_NUMPY_MIN * 8:
+                # no temporary: straight into place
+                off += b32.decode_into(p, mv[off:])
+                continue
+
+            d = decode_part(p, encoding)
+            mv[off:off+len(d)] = d
+            off += len(d)
+        if st: st.bytes_out = off
+    assert off == len(rv)
 
     if encoding == 'Z':
         # decompress
-        z = zlib.decompressobj(wbits=-10)
-        rv = z.decompress(rv)
-        rv += z.flush()
+        with stage(stats, 'inflate', len(rv)) as st:
+            z = zlib.decompressobj(wbits=-10)
+            out = z.decompress(mv)
+            tail = z.flush()
+            mv.release()
+            out = (out + tail) if tail else out
+            if st: st.bytes_out = len(out)
+        return out
+
+    mv.release()
+    return bytes(rv)
+
+def decode_part(p, encoding):
+    # decode the body of a single part into bytes (before any decompression)
+    # - only valid because encoder splits on symbol boundaries
+    if encoding == 'H':
+        return bytes.fromhex(p)
+
+    if len(p) * 5 >= B32_NUMPY_MIN * 8 and _b32():
+        return b32.decode(p)
+
+    padding = (8 - (len(p) % 8)) % 8
+    return b32decode(p + (padding*'='))
+
+class StreamDecoder(io.RawIOBase):
+    # Progressive decoding of a series, as a readable (non-blocking) stream.
+    # - parts may be added in any order, but only the contiguous prefix is decoded
+    # - ZLIB is inflated incrementally by a single long-lived decompressobj
+    # - read() gives None when more parts are needed, b'' at end of data
+
+    def __init__(self, encoding, num_parts):
+        assert encoding in 'H2Z', f'bad encoding: {encoding}'
+        assert num_parts >= 1, 'zero parts?'
+
+        self.encoding = encoding
+        self.num_parts = num_parts
+        self.next_idx = 0               # next part number to be decoded
+        self.held = {}                  # parts received out of order
+        self.buf = bytearray()          # decoded, but not yet read
+        self.z = zlib.decompressobj(wbits=-10) if encoding == 'Z' else None
+
+    def add(self, idx, body):
+        # provide part body; decodes as much as possible
+        assert 0 <= idx < self.num_parts, f'got part {idx} but only expecting {self.num_parts}'
+        if idx < self.next_idx or idx in self.held:
+            # dup, already have it
+            return
+
+        self.held[idx] = body
+
+        while self.next_idx in self.held:
+            body = self.held.pop(self.next_idx)
+            self.next_idx += 1
+
+            data = decode_part(body, self.encoding)
+            if self.z:
+                data = self.z.decompress(data)
+                if self.at_eof:
+                    data += self.z.flush()
+
+            self.buf += data
+
+    @property
+    def at_eof(self):
+        # all parts have been decoded (but maybe not read yet)
+        return self.next_idx == self.num_parts
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self.buf))
+        if not n:
+            return 0 if (self.at_eof or not len(b)) else None
+
+        b[0:n] = self.buf[0:n]
+        del self.buf[0:n]
 
-    return rv
-        
+        return n
 
 # EOF
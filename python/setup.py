@@ -19,6 +19,11 @@ cli_requirements = [
     'click>=6.7',
 ]
 
+# much faster QR/image generation
+fast_requirements = [
+    'numpy',
+]
+
 tests_require = [
     'pytest'
 ]
@@ -38,6 +43,7 @@ setup(
     tests_require=tests_require,
     extras_require={
         'cli': cli_requirements,
+        'fast': fast_requirements,
     },
     url='https://github.com/Coldcard/BBQr',
     author='Coinkite Inc.',
@@ -0,0 +1,239 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+# Speed benchmarks: split, join and render, over test_data corpus and synthetic
+# payloads up to the maximum size (1295 QR's). Also size of animated image files.
+#
+#   python tests/bench.py                       run and show results
+#   python tests/bench.py --save FILE           ... and keep as baseline
+#   python tests/bench.py --compare FILE        ... and compare to baseline (see: make bench)
+#
+# - timings depend on the machine, so baselines are not kept in git: the first
+#   compare on a machine has nothing to compare with, and saves its results instead
+# - time is best of several runs; throughput is payload bytes per second
+# - peak memory is measured (with tracemalloc) in a separate, untimed, run
+#
+import os, sys, json, timeit, random, argparse, tracemalloc
+from glob import glob
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bbqr import split_qrs, join_qrs
+from bbqr.utils import encode_data, decode_data, deflate_default
+from bbqr.consts import HEADER_LEN
+from bbqr.compress import parallel_deflate
+from bbqr.utils import detect_filetype
+from bbqr import render
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'test_data')
+
+# biggest payload that fits in 1295 QR's of version 40, as base32 (no compression)
+MAX_PAYLOAD = ((4296 - HEADER_LEN) // 8 * 8) * 1295 * 5 // 8
+
+# rendering is slow: only this many parts are rendered per payload
+RENDER_PARTS = 8
+
+# animated image files to compare: (format, optimize); gif w/o optimize is pillow's writer
+IMAGE_FILES = [('gif', False), ('gif', True), ('apng', True), ('webp', True)]
+
+# growth in image file size beyond this is a regression
+SIZE_TOLERANCE = 0.01
+
+def corpus():
+    # (name, file type, data): real files, then synthetic
+    for fn in sorted(glob(os.path.join(TEST_DATA, '*.psbt')), key=os.path.getsize) \
+                + sorted(glob(os.path.join(TEST_DATA, '*.txn'))):
+        raw = open(fn, 'rb').read()
+        ft, raw = detect_filetype(fn, raw)
+        yield os.path.basename(fn), ft, raw
+
+    rng = random.Random(42)
+    for size in [10_000, 100_000, 1_000_000, MAX_PAYLOAD]:
+        # random bytes (incompressible) and repetitive text
+        yield f'random-{size}', 'B', rng.randbytes(size)
+        words = [rng.randbytes(rng.randint(2, 8)).hex() for _ in range(500)]
+        txt = ' '.join(rng.choice(words) for _ in range(size // 8)).encode()[0:size]
+        yield f'text-{size}', 'U', txt
+
+def best_time(fn, repeat=3):
+    # lowest time for one call of fn: best of several samples, each
+    # with enough calls to take at least 20ms (so tiny things are measured well)
+    t = timeit.Timer(fn)
+    number, _ = t.autorange()
+    number = max(1, number // 10)
+    return min(t.repeat(repeat=repeat, number=number)) / number
+
+def peak_memory(fn):
+    # bytes allocated at peak, during fn
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def stages(ft, raw):
+    # (stage name, function) for each thing to time, on one payload
+    enc, cooked, _ = encode_data(raw)
+    vers, parts = split_qrs(raw, ft)
+    some = parts[0:RENDER_PARTS]
+
+    yield 'encode_data', lambda: encode_data(raw)
+    yield 'decode_data', lambda: decode_data([cooked], enc)
+    yield 'split_qrs', lambda: split_qrs(raw, ft)
+    yield 'join_qrs', lambda: join_qrs(parts)
+    yield 'render_matrix', lambda: [render.make_matrix(p, vers) for p in some]
+    yield 'render_image', lambda: [render.make_image(p, vers, 4, i, len(parts))
+                                        for i, p in enumerate(some)]
+
+    for fmt, opt in IMAGE_FILES:
+        yield f'image_{fmt}' + ('' if opt else '_pil'), \
+                lambda fmt=fmt, opt=opt: render.image_file(some, vers, fmt, optimize=opt)
+
+    if len(raw) > 0x20000:
+        yield 'parallel_deflate', lambda: parallel_deflate(raw)
+
+def run(quick=False, only=None, names=None):
+    results = {}
+    for name, ft, raw in corpus():
+        if quick and len(raw) > 100_000:
+            continue
+        if only and only not in name:
+            continue
+        if names is not None and name not in names:
+            continue
+
+        rv = results[name] = dict(size=len(raw), stages={})
+        vers, parts = split_qrs(raw, ft)
+        rv.update(version=vers, num_parts=len(parts))
+
+        if len(raw) > 0x20000:
+            # cost of compressing in parallel: how much bigger?
+            rv['deflate_ratio'] = len(parallel_deflate(raw)) / len(deflate_default(raw))
+
+        # size of animated image, per format
+        rv['image_bytes'] = {f'{fmt}{"" if opt else "_pil"}':
+                                len(render.image_file(parts[0:RENDER_PARTS], vers, fmt, optimize=opt))
+                                    for fmt, opt in IMAGE_FILES}
+
+        for stage, fn in stages(ft, raw):
+            secs = best_time(fn)
+            per = len(raw) if not per_part(stage) else min(len(parts), RENDER_PARTS)
+            rv['stages'][stage] = dict(secs=secs, peak=peak_memory(fn),
+                                        rate=per / secs)
+
+        show(name, rv)
+
+    return results
+
+def per_part(stage):
+    # is rate for this stage measured in QR's (else: bytes of payload)
+    return stage.startswith(('render', 'image'))
+
+def show(name, rv):
+    print(f"{name}: {rv['size']} bytes => {rv['num_parts']} x v{rv['version']}"
+            + (f", parallel deflate {(rv['deflate_ratio']-1)*100:+.2f}% size"
+                    if 'deflate_ratio' in rv else ''))
+    for stage, st in rv['stages'].items():
+        unit = 'parts/s' if per_part(stage) else 'MB/s'
+        rate = st['rate'] if unit == 'parts/s' else st['rate'] / 1e6
+        print(f"   {stage:17s} {st['secs']*1000:10.2f} ms  {rate:10.1f} {unit:7s}"
+                f"  peak {st['peak']/1e6:8.2f} MB")
+    if 'image_bytes' in rv:
+        print('   image size: ' + ', '.join(f'{k} {v:,}' for k, v in rv['image_bytes'].items()))
+
+def compare(results, baseline, tolerance):
+    # Compare to baseline. Returns:
+    # - list of (name, stage, ratio) where now slower than baseline by more than tolerance
+    # - list of (name, format, ratio) where image file is now bigger (sizes don't
+    #   depend on the machine, so any real growth counts)
+    # - number of results not in baseline yet: they are added to it (caller saves)
+    slower, bigger, added = [], [], 0
+    print(f"\nCompared to baseline (slower by more than {tolerance:.0%} is flagged):")
+    for name, now in results.items():
+        was = baseline.get(name)
+        if not was:
+            print(f"  NEW    {name:22s} (not in baseline: added)")
+            baseline[name] = now
+            added += 1
+            continue
+
+        for stage, st in now['stages'].items():
+            old = was['stages'].get(stage)
+            if not old:
+                print(f"  NEW    {name:22s} {stage:17s} (not in baseline: added)")
+                was['stages'][stage] = st
+                added += 1
+                continue
+            ratio = st['secs'] / old['secs']
+            flag = ratio > 1 + tolerance
+            print(f"  {'SLOWER' if flag else '      '} {name:22s} {stage:17s} {ratio:6.2f}x time"
+                    f"  {st['peak'] / max(1, old['peak']):6.2f}x memory")
+            if flag:
+                slower.append((name, stage, ratio))
+
+        sizes = was.setdefault('image_bytes', {})
+        for fmt, size in now.get('image_bytes', {}).items():
+            old = sizes.get(fmt)
+            if old is None:
+                print(f"  NEW    {name:22s} {fmt + ' file':17s} (not in baseline: added)")
+                sizes[fmt] = size
+                added += 1
+                continue
+            ratio = size / old
+            flag = ratio > 1 + SIZE_TOLERANCE
+            print(f"  {'BIGGER' if flag else '      '} {name:22s} {fmt + ' file':17s} {ratio:6.2f}x size")
+            if flag:
+                bigger.append((name, fmt, ratio))
+
+    return slower, bigger, added
+
+def main():
+    ap = argparse.ArgumentParser(description="BBQr benchmarks")
+    ap.add_argument('--save', metavar='FILE', help="write results, for use as a baseline")
+    ap.add_argument('--compare', metavar='FILE', help="compare to baseline, and fail if slower")
+    ap.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown (default 0.25)")
+    ap.add_argument('--quick', action='store_true', help="skip payloads over 100k")
+    ap.add_argument('--only', metavar='NAME', help="just payloads with this in their name")
+    args = ap.parse_args()
+
+    results = run(args.quick, args.only)
+
+    if args.save:
+        with open(args.save, 'wt') as fd:
+            json.dump(results, fd, indent=1)
+        print(f"\nSaved: {args.save}")
+
+    if args.compare:
+        if not os.path.exists(args.compare):
+            with open(args.compare, 'wt') as fd:
+                json.dump(results, fd, indent=1)
+            print(f"\nNo baseline yet, so saved these results as one: {args.compare}")
+            return 0
+        baseline = json.load(open(args.compare))
+        slower, bigger, added = compare(results, baseline, args.tolerance)
+
+        if slower:
+            # machines are noisy: measure those again, and keep the better result
+            print("\nMeasuring again, where slower:")
+            again = run(names={name for name, _, _ in slower})
+            for name, stage, _ in slower:
+                st = results[name]['stages'][stage]
+                st['secs'] = min(st['secs'], again[name]['stages'][stage]['secs'])
+            slower, _, _ = compare({n: results[n] for n in again}, baseline, args.tolerance)
+
+        if added:
+            with open(args.compare, 'wt') as fd:
+                json.dump(baseline, fd, indent=1)
+            print(f"\n{added} new results added to baseline: {args.compare}")
+
+        if slower or bigger:
+            print(f"\n{len(slower) + len(bigger)} regressions")
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# EOF
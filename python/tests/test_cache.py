@@ -0,0 +1,103 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+
+from context import bbqr
+import pytest, os
+from bbqr.cache import BBQrCache, make_key, split_qrs_cached
+
+def test_split_cached(tmp_path):
+    raw = os.urandom(3000)
+    cache = BBQrCache(path=str(tmp_path))
+
+    expect = bbqr.split_qrs(raw, 'B', max_version=10)
+    assert split_qrs_cached(cache, raw, 'B', max_version=10) == expect
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    assert split_qrs_cached(cache, raw, 'B', max_version=10) == expect
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # different parameters: different key
+    assert split_qrs_cached(cache, raw, 'B', max_version=11) != expect
+    assert cache.misses == 2
+
+    # new cache on same directory: found on disk
+    c2 = BBQrCache(path=str(tmp_path))
+    assert split_qrs_cached(c2, raw, 'B', max_version=10) == expect
+    assert (c2.hits, c2.disk_hits, c2.misses) == (1, 1, 0)
+
+def test_cli_profile(tmp_path):
+    # make --cache --profile: profiling doesn't stop results being found in cache
+    from click.testing import CliRunner
+    from bbqr.cli import main
+
+    fn = tmp_path / 'in.bin'
+    fn.write_bytes(os.urandom(2000))
+    args = ['make', str(fn), '-v', '10', '--cache', str(tmp_path / 'cache'), '--profile',
+                '-o', str(tmp_path / 'out.png')]
+
+    first = CliRunner().invoke(main, args)
+    assert first.exit_code == 0
+    assert 'Cache: 0 hits, 2 misses' in first.output
+
+    again = CliRunner().invoke(main, args)
+    assert again.exit_code == 0
+    assert 'Cache: 2 hits, 0 misses' in again.output
+    assert 'stage' in again.output
+
+def test_foreign_files(tmp_path):
+    # other files in the directory are never counted, evicted or cleared
+    (tmp_path / 'thesis.docx').write_bytes(b'x' * 5000)
+    (tmp_path / ('a' * 63)).write_bytes(b'x')
+    (tmp_path / 'sub').mkdir()
+
+    cache = BBQrCache(max_mem=0, path=str(tmp_path), max_disk=100)
+    assert cache.disk_size == 0
+
+    cache.put(make_key('x', '1'), b'1' * 60)
+    cache.put(make_key('x', '2'), b'2' * 60)
+    assert cache.disk_size == 60
+    assert cache.get(make_key('x', '2')) == b'2' * 60
+
+    # not a key: memory only, never a path
+    cache.put('../escape', b'e')
+    assert not (tmp_path.parent / 'escape').exists()
+
+    cache.clear()
+    assert sorted(os.listdir(str(tmp_path))) == sorted(['a' * 63, 'sub', 'thesis.docx'])
+    assert (tmp_path / 'thesis.docx').read_bytes() == b'x' * 5000
+
+def test_eviction(tmp_path):
+    cache = BBQrCache(max_mem=1000, path=str(tmp_path), max_disk=2500)
+    keys = [make_key('x', str(n)) for n in range(5)]
+    assert len(set(keys)) == 5
+
+    for n, k in enumerate(keys):
+        cache.put(k, bytes([n]) * 400)
+
+    # memory holds last two, disk holds all
+    assert list(cache.mem) == keys[-2:]
+    assert cache.mem_size == 800
+    assert cache.disk_size == 2000
+
+    # oldest is used again, so it's kept on disk
+    os.utime(os.path.join(str(tmp_path), keys[0]), (1, 1))
+    for n, k in enumerate(keys[1:]):
+        os.utime(os.path.join(str(tmp_path), k), (n+10, n+10))
+    assert cache.get(keys[0]) == bytes(400)
+
+    cache.put(make_key('x', 'big'), b'b' * 1000)
+    assert cache.disk_size <= 2500
+    assert sorted(os.listdir(str(tmp_path))) == sorted(keys[0:1] + keys[3:] + [make_key('x', 'big')])
+
+    # too big to keep in memory, but fine on disk
+    huge = make_key('x', 'huge')
+    cache.put(huge, b'h' * 2000)
+    assert huge not in cache.mem
+    assert cache.get(huge) == b'h' * 2000
+
+    cache.clear()
+    assert not os.listdir(str(tmp_path))
+    assert cache.get(keys[0]) is None
+
+# EOF
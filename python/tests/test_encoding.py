@@ -3,7 +3,7 @@
 #
 
 from context import bbqr
-import pytest, os, pyqrcode
+import pytest, os, zlib, pyqrcode
 
 @pytest.mark.parametrize('fname', [
 	'../test_data/1in1000out.psbt',
@@ -49,4 +49,199 @@ def test_base36(val):
 
     assert int(s, 36) == val
 
+def test_capacity_table():
+    # built-in table must match pyqrcode's knowledge
+    from bbqr.consts import ALNUM_CAPACITY, version_size
+
+    for v in range(1, 41):
+        assert version_size(v) == pyqrcode.tables.version_size[v]
+        for ecc in 'LMQH':
+            assert ALNUM_CAPACITY[ecc][v] == pyqrcode.tables.data_capacity[v][ecc][2]
+
+@pytest.mark.parametrize('split_mod', [2, 8])
+@pytest.mark.parametrize('limits', [dict(), dict(min_split=3), dict(max_split=2),
+                            dict(max_version=11), dict(min_version=27, max_version=27),
+                            dict(min_split=5, max_split=9, min_version=1, max_version=20)])
+def test_planner(split_mod, limits):
+    # binary search planner must match simple linear scan
+    from bbqr.split import find_best_version, num_qr_needed
+
+    def linear(ll, split_mod, min_split=1, max_split=1295, min_version=5, max_version=40):
+        min_version = min(min_version, max_version)
+        options = []
+        for ver in range(min_version, max_version+1):
+            count, pe = num_qr_needed(ver, ll, split_mod)
+            if not (min_split <= count <= max_split): continue
+            options.append( (ver, count, pe) )
+        options.sort(key=lambda v: (v[1], v[0]))
+        if not options:
+            raise ValueError("Cannot make it fit")
+        return options[0]
+
+    for ll in list(range(1, 3000, 7)) + list(range(3000, 5_000_000, 9973)):
+        try:
+            expect = linear(ll, split_mod, **limits)
+        except ValueError:
+            with pytest.raises(ValueError):
+                find_best_version(ll, split_mod, **limits)
+            continue
+
+        assert find_best_version(ll, split_mod, **limits) == expect
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_compress_search(jobs):
+    # search can only help, and result must decode normally
+    from bbqr.compress import compress_search
+    from bbqr.utils import encode_data, decode_data
+
+    raw = open('../test_data/1in100out.psbt', 'rb').read()
+
+    cmp, settings = compress_search(raw, time_budget=0.25, jobs=jobs, max_version=10)
+    assert len(settings) == 3
+
+    enc, cooked, _ = encode_data(raw, 'Z', compress=lambda r: cmp)
+    assert enc == 'Z'
+    assert decode_data([cooked], 'Z') == raw
+
+    v1, parts1 = bbqr.split_qrs(raw, 'P', max_version=10)
+    v2, parts2 = bbqr.split_qrs(raw, 'P', max_version=10, compress_search=0.25, search_jobs=jobs)
+    assert (len(parts2), v2) <= (len(parts1), v1)
+    assert bbqr.join_qrs(parts2) == ('P', raw)
+
+@pytest.mark.parametrize('chunk_size', [100, 1024, 5000, 0x20000])
+def test_parallel_deflate(chunk_size):
+    # one stream, which normal decoder handles; same as usual if just one chunk
+    from bbqr.compress import parallel_deflate
+    from bbqr.utils import deflate_default, decode_data, encode_data
+
+    raw = open('../test_data/real-scan.txt', 'rb').read() * 20
+    raw += os.urandom(1000) + raw
+
+    cmp = parallel_deflate(raw, jobs=3, chunk_size=chunk_size)
+    enc, cooked, _ = encode_data(raw, 'Z', compress=lambda r: cmp)
+    assert decode_data([cooked], enc) == raw
+
+    if chunk_size >= len(raw):
+        assert cmp == deflate_default(raw)
+    elif chunk_size >= 1024:
+        # priming each chunk with the one before keeps the loss small
+        assert len(cmp) < 1.05 * len(deflate_default(raw))
+
+    for short in [b'', b'a', raw[0:chunk_size], raw[0:chunk_size+1]]:
+        assert zlib.decompress(parallel_deflate(short, jobs=2, chunk_size=chunk_size), -10) == short
+
+    _, parts = bbqr.split_qrs(raw, 'U', compress_jobs=3)
+    assert bbqr.join_qrs(parts) == ('U', raw)
+
+@pytest.mark.parametrize('encoding', 'H2Z')
+def test_decode_alignment(encoding):
+    # parts split off a symbol boundary are rejected
+    from bbqr.utils import encode_data, decode_data
+
+    raw = os.urandom(500)
+    enc, cooked, split_mod = encode_data(raw, encoding)
+
+    cut = split_mod * 10
+    assert decode_data([cooked[:cut], cooked[cut:]], enc) == raw
+
+    with pytest.raises(AssertionError):
+        decode_data([cooked[:cut+1], cooked[cut+1:]], enc)
+
+def test_scan_time_planner():
+    from bbqr.split import find_best_version
+    from bbqr.scanner import ScannerModel, find_fastest_version, expected_scan_time
+
+    # perfect camera: only frame count matters, same as normal planner
+    perfect = ScannerModel(30, [1.0]*41)
+    for ll in [100, 5000, 30000, 100000]:
+        ver, count, _ = find_fastest_version(ll, 8, perfect)
+        assert count == find_best_version(ll, 8)[1]
+
+    # camera that cannot deal with big QR: smaller version, more frames
+    fussy = ScannerModel(30, lambda v: 0.9 if v <= 15 else 0.05)
+    ver, count, _ = find_fastest_version(30000, 8, fussy)
+    assert ver <= 15
+    assert count > find_best_version(30000, 8)[1]
+
+    # more losses, longer to scan
+    slow = [expected_scan_time(ScannerModel(10, [p]*41), 20, 10) for p in (1, .8, .5, .1)]
+    assert slow == sorted(slow)
+
+    raw = os.urandom(30000)
+    vers, parts = bbqr.split_qrs(raw, 'B', scanner=fussy)
+    assert vers <= 15
+    assert bbqr.join_qrs(parts) == ('B', raw)
+
+    best = bbqr.plan_split(raw, scanner=fussy)[0]
+    assert best.version <= 15
+
+    # camera that cannot read big QR at all: those versions are never picked
+    blind = ScannerModel(30, lambda v: .9 if v <= 20 else 0)
+    for ll in [500, 50000]:
+        ver, count, _ = find_fastest_version(ll, 8, blind)
+        assert ver <= 20
+    with pytest.raises(ValueError):
+        find_fastest_version(500, 8, blind, min_version=21)
+
+def test_b32_numpy():
+    # numpy base32 must match stdlib exactly, results and errors
+    b32 = pytest.importorskip('bbqr.b32')
+    from base64 import b32encode, b32decode
+
+    for ln in list(range(0, 42)) + [999, 1000, 0x12345]:
+        raw = os.urandom(ln)
+        txt = b32encode(raw).decode('ascii').rstrip('=')
+        assert b32.encode(raw) == txt
+        assert b32.decode(txt) == raw
+
+        out = bytearray(ln + 3)
+        assert b32.decode_into(txt, memoryview(out)[3:]) == ln
+        assert out[3:] == raw
+
+    for bad in ['A', 'ABC', 'ABCDEF', 'ABCDEFGHA', 'abcdefgh', 'ABCDEFG1', 'ABCD=EFG', 'ABCDEFG ']:
+        with pytest.raises(Exception) as stdlib:
+            b32decode(bad + '=' * ((8 - len(bad) % 8) % 8))
+        with pytest.raises(stdlib.type):
+            b32.decode(bad)
+
+@pytest.mark.parametrize('per_each', [8, 16, 1000, 4288])
+def test_b32_parts(per_each):
+    # encoded straight into parts: same as slicing up the whole encoding
+    b32 = pytest.importorskip('bbqr.b32')
+    from base64 import b32encode
+
+    for ln in [1, 4, 5, 6, 599, 600, 601, 0x12345]:
+        raw = os.urandom(ln)
+        txt = b32encode(raw).decode('ascii').rstrip('=')
+        chunks = [txt[i:i+per_each] for i in range(0, len(txt), per_each)]
+        hdrs = [f'B$2B{n % 10000:04d}' for n in range(len(chunks))]
+
+        assert b32.encode_parts(raw, hdrs, per_each) == [h+c for h, c in zip(hdrs, chunks)]
+
+    # a single part can be any length
+    assert b32.encode_parts(b'hello', ['B$2U0100'], 9) == ['B$2U0100NBSWY3DP']
+
+def test_lazy_numpy():
+    # small payloads don't need numpy, so don't pay to import it
+    import subprocess, sys
+    code = ("import sys, bbqr; bbqr.join_qrs(bbqr.split_qrs(b'x'*300, 'B')[1]); "
+            "print('numpy' in sys.modules)")
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                    cwd=os.path.join(os.path.dirname(__file__), '..'))
+    assert out.strip() == b'False'
+
+@pytest.mark.parametrize('size', [10, 5000])
+def test_b32_fallback(size, monkeypatch):
+    # same parts with and without numpy
+    from bbqr import utils
+
+    raw = os.urandom(size)
+    _, parts = bbqr.split_qrs(raw, 'B', encoding='2', max_version=5)
+
+    monkeypatch.setattr(utils, 'b32', None)
+    _, parts2 = bbqr.split_qrs(raw, 'B', encoding='2', max_version=5)
+
+    assert parts == parts2
+    assert bbqr.join_qrs(parts) == ('B', raw)
+
 # EOF
@@ -14,4 +14,241 @@ def test_real_scan():
     assert b'Zlib compressed' in data
     assert b'PSBT' in data
 
+def test_parse_part():
+    _, parts = bbqr.split_qrs(os.urandom(2000), 'B', encoding='H', max_version=5)
+
+    for n, text in enumerate(parts):
+        p = bbqr.parse_part(text)
+        assert (p.encoding, p.file_type, p.num_parts, p.index) == ('H', 'B', len(parts), n)
+        assert p.text is text
+        assert p.hdr + text[6:8] + p.body == text
+
+    j = bbqr.BBQrJoiner()
+    for text in parts:
+        j.add(bbqr.parse_part(text))
+    assert j.is_complete
+
+    for bad in ['', 'B$', 'hello world', 'X$HB0100', 'B$QB0100', 'B$H?0100',
+                    'B$HB0000', 'B$HB0101', 'B$HB01!0', 'B$HBzz00', 'B$Hb0100']:
+        with pytest.raises(AssertionError):
+            bbqr.parse_part(bad)
+
+    # file types we don't know (yet) are still joined, as the JS decoder does
+    from bbqr.consts import KNOWN_FILETYPES
+    assert 'A' not in KNOWN_FILETYPES
+    assert bbqr.join_qrs(['B$2A0100NBSWY3DP']) == ('A', b'hello')
+    with pytest.raises(AssertionError):
+        bbqr.split_qrs(b'hello', 'A')
+
+def test_incremental():
+    lines = [ln.strip() for ln in open('../test_data/real-scan.txt', 'rt').readlines() if ln.strip()]
+    expect = bbqr.join_qrs(lines)
+
+    j = bbqr.BBQrJoiner()
+    assert j.progress == (0, None)
+
+    for ln in reversed(lines):
+        rv = j.add(ln)
+        if rv is None:
+            assert j.missing
+            assert not j.is_complete
+        else:
+            assert rv == expect
+            assert not j.missing
+
+    assert j.is_complete
+    assert j.progress == (j.num_parts, j.num_parts)
+
+    # dups are fine, but must match
+    assert j.add(lines[0]) == expect
+    with pytest.raises(AssertionError):
+        j.add(lines[0][0:-1] + ('A' if lines[0][-1] != 'A' else 'B'))
+
+def test_incremental_conflict():
+    vers, parts = bbqr.split_qrs(os.urandom(5000), 'B', encoding='2', max_version=10)
+    _, other = bbqr.split_qrs(os.urandom(5000), 'T', encoding='2', max_version=10)
+    assert len(parts) >= 3
+
+    j = bbqr.BBQrJoiner()
+    assert j.add(parts[1]) is None
+    assert j.missing == set(range(len(parts))) - {1}
+
+    with pytest.raises(AssertionError, match='conflicting'):
+        j.add(other[0])
+
+    with pytest.raises(AssertionError, match='fixed header'):
+        bbqr.BBQrJoiner().add('hello world')
+
+@pytest.mark.parametrize('encoding', 'H2Z')
+def test_streaming(encoding):
+    data = open('../test_data/1in100out.psbt', 'rb').read()
+    vers, parts = bbqr.split_qrs(data, 'P', encoding=encoding, max_version=8)
+    assert len(parts) > 3
+
+    j = bbqr.BBQrJoiner(stream=True)
+
+    # out of order: nothing decoded until first part arrives
+    assert j.add(parts[2]) is None
+    assert j.stream.read() is None
+
+    got = b''
+    for p in parts:
+        rv = j.add(p)
+        chunk = j.stream.read()
+        if chunk:
+            got += chunk
+
+        if p is parts[0]:
+            # have a prefix now
+            assert data.startswith(got) and got
+
+    file_type, fd = rv
+    assert file_type == 'P'
+    got += fd.read()
+    assert fd.read() == b''
+    assert got == data
+
+def test_async_session():
+    import asyncio
+    from bbqr.aio import ScanSession, join_async
+
+    data = os.urandom(8000)
+    vers, parts = bbqr.split_qrs(data, 'B', max_version=10)
+
+    async def feed(delay=0):
+        for p in reversed(parts):
+            await asyncio.sleep(delay)
+            yield p
+
+    async def short():
+        # first part never arrives
+        for p in parts[1:]:
+            yield p
+
+    async def main():
+        # from async iterator
+        assert await join_async(feed()) == ('B', data)
+
+        # pushed in, with backpressure
+        sess = ScanSession(max_pending=2)
+        task = sess.start()
+        for p in parts:
+            await sess.put(p)
+        assert await task == ('B', data)
+
+        # idle timeout
+        with pytest.raises(asyncio.TimeoutError):
+            await join_async(feed(0.5), idle_timeout=0.05)
+
+        # ends early
+        with pytest.raises(EOFError):
+            await join_async(short())
+
+        # cancelled
+        sess = ScanSession()
+        task = sess.start()
+        await sess.put(parts[0])
+        sess.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+def test_demux():
+    from itertools import cycle
+    from bbqr.demux import BBQrDemux
+
+    # three series, two with identical headers
+    a = os.urandom(3000)
+    b = os.urandom(3000)
+    c = b'hello' * 600
+    _, pa = bbqr.split_qrs(a, 'B', encoding='2', max_version=8)
+    _, pb = bbqr.split_qrs(b, 'B', encoding='2', max_version=8)
+    _, pc = bbqr.split_qrs(c, 'U', max_version=8)
+    assert pa[0][0:6] == pb[0][0:6]
+
+    # scanner sees animations looping, frames from each interleaved
+    stream = []
+    for loop in range(3):
+        for trio in zip(pa, pb, cycle(pc)):
+            stream.extend(trio)
+
+    dm = BBQrDemux()
+    got = []
+    for p in stream:
+        got.extend(dm.add(p))
+
+    assert sorted(got) == sorted([('B', a), ('B', b), ('U', c)])
+    assert not dm.errors
+
+def test_demux_shared_parts():
+    # new series which shares parts with one already completed, still completes
+    from bbqr.demux import BBQrDemux
+
+    common = os.urandom(4000)
+    a = common + os.urandom(1000)
+    b = common + os.urandom(1000)
+    _, pa = bbqr.split_qrs(a, 'B', encoding='H', max_version=20)
+    _, pb = bbqr.split_qrs(b, 'B', encoding='H', max_version=20)
+    assert pa[0] == pb[0] and pa[-1] != pb[-1]
+
+    dm = BBQrDemux()
+    got = []
+    for p in pa:
+        got.extend(dm.add(p))
+    assert got == [('B', a)]
+
+    # old one still looping: ignored
+    for p in pa:
+        assert dm.add(p) == []
+    assert not dm.sessions
+
+    got = []
+    for loop in range(5):
+        for p in pb:
+            got.extend(dm.add(p))
+    assert got == [('B', b)]
+    assert not dm.errors
+
+def test_demux_evict():
+    from bbqr.demux import BBQrDemux
+
+    now = [0]
+    dm = BBQrDemux(max_sessions=2, max_age=10, clock=lambda: now[0])
+
+    series = [bbqr.split_qrs(os.urandom(2000), 'B', max_version=5)[1] for i in range(3)]
+    for s in series:
+        dm.add(s[0])
+    assert len(dm.sessions) == 2
+    assert dm.progress == [(1, len(series[1])), (1, len(series[2]))]
+
+    dm.add(series[2][1])
+    assert dm.progress == [(1, len(series[1])), (2, len(series[2]))]
+
+    now[0] = 11
+    dm.add(series[2][2])
+    assert dm.progress == [(1, len(series[2]))]
+
+def test_decode_follow():
+    # output appears as soon as each series is complete: no need for EOF
+    import subprocess, sys
+
+    _, a = bbqr.split_qrs(os.urandom(2000), 'B', encoding='H', max_version=5)
+    _, b = bbqr.split_qrs(b'hello world', 'U')
+    top = os.path.dirname(os.path.dirname(os.path.abspath(bbqr.__file__)))
+
+    proc = subprocess.Popen([sys.executable, '-c', 'from bbqr.cli import main; main()',
+                                'decode', '--follow'], cwd=top, text=True,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+    try:
+        feed = ['noise', 'QR-Code:' + a[0], 'B$garbage'] + a + b
+        proc.stdin.write('\n'.join(feed) + '\n')
+        proc.stdin.flush()
+
+        assert proc.stdout.readline() == 'hello world\n'
+    finally:
+        proc.stdin.close()
+        assert proc.wait(10) == 0
+
 # EOF
@@ -78,6 +78,187 @@ def test_edge27(low_ent, encoding, size, version=27):
     assert readback == data
     #valid_qr(vers, parts)
 
+@pytest.mark.parametrize('encoding', [None]+list('H2Z'))
+@pytest.mark.parametrize('size', [10, 2000, 10_000, 200_000])
+@pytest.mark.parametrize('low_ent', [True, False])
+def test_split_iter(encoding, size, low_ent):
+    # lazy version must give exactly the same parts
+    import io
+
+    if low_ent:
+        data = b'A'*size
+    else:
+        data = os.urandom(size)
+
+    expect = bbqr.split_qrs(data, 'B', encoding=encoding, max_version=20)
+
+    fd = io.BytesIO(b'junk' + data)
+    fd.read(4)
+    vers, count, parts = bbqr.split_qrs_iter(fd, 'B', encoding=encoding, max_version=20)
+    parts = list(parts)
+
+    assert count == len(parts)
+    assert (vers, parts) == expect
+
+@pytest.mark.parametrize('size', [10, 1000, 1062, 1063, 5000, 30_000])
+@pytest.mark.parametrize('low_ent', [True, False])
+@pytest.mark.parametrize('limits', [dict(max_version=27), dict(min_split=3, max_version=15),
+                                    dict(max_split=2, min_version=27, max_version=27)])
+def test_optimize(size, low_ent, limits):
+    # planner considers all encodings, picks fewest QR then lowest version
+    if low_ent:
+        data = b'A'*size
+    else:
+        data = os.urandom(size)
+
+    opts = bbqr.plan_split(data, **limits)
+    assert 2 <= len(opts) <= 3
+    assert {o.encoding for o in opts} >= set('H2')
+
+    fits = [(o.count, o.version) for o in opts if o.count]
+    if not fits:
+        with pytest.raises(ValueError):
+            bbqr.split_qrs(data, 'B', optimize=True, **limits)
+        return
+
+    assert (opts[0].count, opts[0].version) == min(fits)
+
+    # planner reports what it considered, same as plan_split()
+    plan = []
+    vers, parts = bbqr.split_qrs(data, 'B', optimize=True, plan=plan, **limits)
+    assert plan == opts
+    assert (len(parts), vers) == min(fits)
+    assert parts[0][2] == opts[0].encoding
+    assert bbqr.join_qrs(parts) == ('B', data)
+
+    # never worse than default choice
+    try:
+        v2, p2 = bbqr.split_qrs(data, 'B', **limits)
+        assert (len(parts), vers) <= (len(p2), v2)
+    except ValueError:
+        pass
+
+def test_cli_jobs(tmp_path):
+    # more workers (-j) never changes the result; threaded compression is separate
+    from click.testing import CliRunner
+    from bbqr.cli import main
+
+    fn = tmp_path / 'big.txt'
+    raw = b' '.join(b'%d' % (n * n) for n in range(60_000))
+    assert len(raw) > 0x20000
+    fn.write_bytes(raw)
+
+    run = lambda *args: CliRunner().invoke(main, ['make', str(fn)] + list(args))
+    one = run('-j', '1')
+    assert one.exit_code == 0
+    assert run('-j', '3').stdout == one.stdout
+
+    threaded = run('--compress-jobs', '3')
+    parts = threaded.stdout.split()
+    assert bbqr.join_qrs(parts) == ('U', raw)
+
+def test_sniff_filetype():
+    # PSBT found by its magic bytes, whatever the name; misnamed files are errors
+    from bbqr.utils import detect_filetype
+    import glob
+
+    fn = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', '..', 'test_data', '*.psbt')))[0]
+    psbt = open(fn, 'rb').read()
+    assert detect_filetype('', psbt) == ('P', psbt)
+    assert detect_filetype('foo.bin', psbt)[0] == 'P'
+    assert detect_filetype('', b'hello')[0] == 'U'
+    assert detect_filetype('', b'\xff\xfe')[0] == 'B'
+    assert detect_filetype('', b'{"a": 1}')[0] == 'J'
+    assert detect_filetype('', b'02000000ab\ncd') == ('T', bytearray(b'\x02\0\0\0\xab\xcd'))
+
+    with pytest.raises(ValueError, match='Base64'):
+        detect_filetype('x.psbt', b'cHNidP8BAHECAAAAAQ')
+    with pytest.raises(ValueError, match='Not a PSBT'):
+        detect_filetype('x.psbt', b'\x00\x01\x02')
+
+@pytest.mark.parametrize('encoding', [None]+list('H2Z'))
+def test_mapped_input(encoding, tmp_path):
+    # make: file is mmap'ed, hex transactions converted in blocks
+    from bbqr.cli import map_file, detect_filetype
+
+    txn = b'\x02\x00\x00\x00' + os.urandom(200_000)
+    fn = tmp_path / 'txn.hex'
+    fn.write_bytes(txn.hex().encode() + b'\n')
+
+    with open(fn, 'rb') as fd:
+        raw = map_file(fd)
+        assert isinstance(raw, memoryview)
+
+        ft, raw = detect_filetype(fd.name, raw)
+        assert (ft, raw) == ('T', txn)
+
+        raw = map_file(fd)
+        expect = bbqr.split_qrs(fn.read_bytes(), 'U', encoding=encoding)
+        assert bbqr.split_qrs(raw, 'U', encoding=encoding) == expect
+
+    from bbqr.utils import unhex_chunks
+    assert b''.join(unhex_chunks([b'0', b'1 0', b'2\n'])) == b'\x01\x02'
+    with pytest.raises(ValueError):
+        b''.join(unhex_chunks([b'012']))
+
+@pytest.mark.parametrize('memory', [False, True])
+def test_stats(memory):
+    from bbqr.stats import Stats
+
+    calls = []
+    stats = Stats(hook=lambda *a: calls.append(a), memory=memory)
+    raw = b'hello ' * 5000
+
+    vers, parts = bbqr.split_qrs(raw, 'U', max_version=10, stats=stats)
+    assert list(stats.stages) == ['compress', 'plan', 'encode']
+    assert stats.stages['compress'].bytes_in == len(raw)
+    assert stats.compression_ratio < 0.1
+    assert stats.counters['versions_tried'] >= 1
+    assert stats.stages['encode'].bytes_out == sum(len(p) for p in parts)
+    assert [c[0] for c in calls] == list(stats.stages)
+    assert all((st.alloc > 0) == memory for st in stats.stages.values())
+
+    assert bbqr.join_qrs(parts, stats=stats) == ('U', raw)
+    assert stats.stages['inflate'].bytes_out == len(raw)
+    assert 'decode' in stats.report()
+
+@pytest.mark.parametrize('processes', [False, True])
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_batch(jobs, processes):
+    # order kept, errors returned in place
+    items = [os.urandom(n) for n in range(100, 6000, 700)]
+    items.insert(2, (b'A'*100, 'J'))
+    items.insert(4, (b'A'*100, 'q'))        # bad type code
+
+    got = bbqr.split_many(items, 'B', jobs=jobs, processes=processes, max_version=10)
+    assert len(got) == len(items)
+    assert isinstance(got[4], AssertionError)
+
+    lists = [rv[1] if not isinstance(rv, Exception) else ['B$ZZ'] for rv in got]
+    back = bbqr.join_many(lists, jobs=jobs, processes=processes)
+
+    for item, rv in zip(items, back):
+        if item == items[4]:
+            assert isinstance(rv, Exception)
+        elif isinstance(item, tuple):
+            assert rv == (item[1], item[0])
+        else:
+            assert rv == ('B', item)
+
+def test_light_import():
+    # plain split/join doesn't drag in process pools (only needed for batch)
+    import subprocess, sys
+    code = ("import sys, bbqr; bbqr.join_qrs(bbqr.split_qrs(b'x'*300, 'B')[1]); "
+            "print(sorted(m for m in ('multiprocessing', 'concurrent.futures.process') "
+            "if m in sys.modules))")
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                    cwd=os.path.join(os.path.dirname(__file__), '..'))
+    assert out.strip() == b'[]'
+
+    assert bbqr.split_many is bbqr.batch.split_many
+    with pytest.raises(AttributeError):
+        bbqr.not_there
+
 @pytest.mark.parametrize('encoding', 'H2')
 def test_maxsize(encoding):
     # Build largest possible QR series for each encoding.
@@ -0,0 +1,58 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+
+from context import bbqr
+import pytest, os, random, pyqrcode
+
+np = pytest.importorskip('numpy')
+
+from bbqr.qr import encode_qr, ALNUM_CHARS
+from bbqr.utils import version_to_chars
+
+@pytest.mark.parametrize('ver', range(1, 41))
+def test_vs_pyqrcode(ver):
+    # must produce exactly same QR as pyqrcode, including mask choice
+    cap = version_to_chars(ver)
+
+    for ln in [1, cap//3, cap-1, cap]:
+        if ver > 20 and ln != cap: continue         # pyqrcode is slow
+        msg = ''.join(random.choice(ALNUM_CHARS) for _ in range(ln))
+
+        q = pyqrcode.create(msg, error='L', version=ver, mode='alphanumeric')
+        expect = np.array(q.code, dtype=np.uint8)
+
+        assert (encode_qr(msg, ver, mask=q.builder.best_mask) == expect).all()
+        assert (encode_qr(msg, ver) == expect).all()
+
+def test_too_big():
+    with pytest.raises(ValueError):
+        encode_qr('A' * 26, 1)
+
+    with pytest.raises(AssertionError):
+        encode_qr('lower', 1)
+
+def test_render_paths(monkeypatch):
+    # images and SVG from our matrix match those from pyqrcode
+    import io
+    from PIL import Image, ImageChops
+    from bbqr import render
+
+    vers, parts = bbqr.split_qrs(os.urandom(3000), 'B', max_version=15)
+    for p in parts[0:2]:
+        q = render.make_qr(p, vers)
+
+        xbm = q.xbm(scale=3, quiet_zone=10)
+        old = ImageChops.invert(Image.open(io.BytesIO(xbm.encode()))).convert('L')
+        assert render.matrix_image(render.make_matrix(p, vers), 3).tobytes() == old.tobytes()
+
+        with monkeypatch.context() as m:
+            # without numpy
+            m.setattr(render, 'np', None)
+            assert render.matrix_image(q.code, 3).tobytes() == old.tobytes()
+
+        svg = io.BytesIO()
+        q.svg(svg, scale=4)
+        assert render.make_svg(p, vers) == svg.getvalue()
+
+# EOF
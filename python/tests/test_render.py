@@ -0,0 +1,197 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+
+from context import bbqr
+import pytest, os
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_render_order(jobs):
+    # pool must give back same frames, in same order
+    from bbqr import render
+
+    vers, parts = bbqr.split_qrs(os.urandom(2000), 'B', max_version=8)
+    assert len(parts) > 3
+
+    imgs = render.render_images(parts, vers, scale=2, jobs=jobs)
+    assert len(imgs) == len(parts)
+
+    for i in [0, len(parts)-1]:
+        assert imgs[i].tobytes() == render.make_image(parts[i], vers, 2, i, len(parts)).tobytes()
+
+    svgs = render.render_svgs(parts, vers, jobs=jobs)
+    assert svgs[1] == render.make_svg(parts[1], vers)
+
+@pytest.mark.parametrize('scale', [1, 2, 4, 7])
+def test_frame_image(scale, monkeypatch):
+    # palette frames look exactly like those drawn the slow way
+    pytest.importorskip('numpy')
+    from bbqr import render
+
+    vers, parts = bbqr.split_qrs(os.urandom(5000), 'B', max_version=9)
+    n = len(parts)
+    assert n > 5
+
+    for i in [0, 1, n-2, n-1]:
+        fast = render.make_image(parts[i], vers, scale, i, n)
+        assert fast.mode == 'P'
+
+        with monkeypatch.context() as m:
+            m.setattr(render, 'np', None)
+            slow = render.make_image(parts[i], vers, scale, i, n)
+
+        assert fast.convert('L').tobytes() == slow.tobytes()
+
+    # template is shared, and not changed by use
+    t = render.frame_template(len(render.make_matrix(parts[0], vers)), scale, 10, n)
+    assert not t.flags.writeable
+    assert set(t.ravel()) == {render.WHITE, render.GREY}
+
+@pytest.mark.parametrize('fmt', ['gif', 'apng', 'webp'])
+@pytest.mark.parametrize('count', [1, 6])
+def test_image_file(fmt, count):
+    # every frame of animation comes back as rendered, whatever the file format
+    from PIL import Image, ImageSequence, features
+    from bbqr import render
+    import io
+
+    if fmt == 'webp' and not features.check('webp'):
+        pytest.skip('no WebP support')
+
+    vers, parts = bbqr.split_qrs(os.urandom(100 * count), 'B', max_version=10,
+                                        min_split=count, max_split=count)
+    assert len(parts) == count
+
+    expect = render.render_images(parts, vers, scale=3)
+    got = Image.open(io.BytesIO(render.image_file(parts, vers, fmt, scale=3, frame_delay=150)))
+    frames, delays = [], set()
+    for f in ImageSequence.Iterator(got):
+        frames.append(f.convert('L').tobytes())
+        delays.add(f.info.get('duration'))
+
+    assert frames == [f.convert('L').tobytes() for f in expect]
+    if count > 1:
+        assert delays == {150}
+
+def test_gif_delta():
+    # our GIF writer: only changed area of each frame is stored, yet smaller & same result
+    pytest.importorskip('numpy')
+    from PIL import Image, ImageSequence
+    from bbqr import render
+    import io
+
+    vers, parts = bbqr.split_qrs(os.urandom(3000), 'B', max_version=10)
+    n = len(parts)
+
+    ours = render.image_file(parts, vers, 'gif')
+    plain = render.image_file(parts, vers, 'gif', optimize=False)
+    assert len(ours) < len(plain)
+
+    a, b = [list(ImageSequence.Iterator(Image.open(io.BytesIO(x)))) for x in (ours, plain)]
+    assert len(a) == len(b) == n
+    for fa, fb in zip(a, b):
+        assert fa.convert('L').tobytes() == fb.convert('L').tobytes()
+
+    # after first frame: QR data area and progress bar, but not the quiet zone above
+    im = Image.open(io.BytesIO(ours))
+    assert im.tile[0][1] == (0, 0) + im.size
+    im.seek(1)
+    x0, y0, x1, y1 = im.tile[0][1]
+    assert y0 >= 10 * 4
+    assert (x1 - x0) * (y1 - y0) < im.width * im.height
+
+@pytest.mark.parametrize('broken', [AttributeError, TypeError, OSError])
+def test_gif_fallback(broken, monkeypatch):
+    # our GIF writer needs pillow internals: if they go away (or change), pillow's
+    # own writer is used instead
+    pytest.importorskip('numpy')
+    from bbqr import render
+
+    vers, parts = bbqr.split_qrs(os.urandom(1000), 'B', max_version=5)
+    plain = render.image_file(parts, vers, 'gif', optimize=False)
+
+    def lzw(px):
+        raise broken('pillow changed')
+    monkeypatch.setattr(render, '_lzw', lzw)
+
+    assert render.image_file(parts, vers, 'gif') == plain
+
+@pytest.mark.parametrize('garbage', [b'', b'\x02\xff' + bytes(255) + b'\x00', 'last'])
+def test_gif_corrupt(garbage, monkeypatch):
+    # our GIF writer makes bad LZW data without error: file is checked, pillow's used
+    pytest.importorskip('numpy')
+    from bbqr import render
+
+    vers, parts = bbqr.split_qrs(os.urandom(1000), 'B', max_version=5)
+    plain = render.image_file(parts, vers, 'gif', optimize=False)
+
+    lzw, calls = render._lzw, []
+    def bad_lzw(px):
+        calls.append(1)
+        if garbage == 'last':
+            # only last frame is wrong: all blank
+            return lzw(px if len(calls) < len(parts) else px * 0)
+        return garbage
+    monkeypatch.setattr(render, '_lzw', bad_lzw)
+
+    assert render.image_file(parts, vers, 'gif') == plain
+    assert calls
+
+def svg_modules(d, quiet_zone):
+    # set of (row, col) drawn by path data, as made by runs_path()
+    import re
+    rv = set()
+    x = y = 0
+    for cmd, a, b in re.findall(r'([Mmh])(-?[\d.]+)(?: (-?[\d.]+))?', d):
+        if cmd == 'M':
+            x, y = float(a), float(b)
+        elif cmd == 'm':
+            x, y = x + float(a), y + float(b)
+        else:
+            for i in range(int(a)):
+                rv.add((int(y - .5) - quiet_zone, int(x) + i - quiet_zone))
+            x += int(a)
+    return rv
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_animated_svg(numpy, monkeypatch):
+    # one SVG: shared modules once, then one path per frame; together they make each QR
+    import re
+    from bbqr import render
+
+    vers, parts = bbqr.split_qrs(os.urandom(2000), 'B', max_version=8)
+    n = len(parts)
+    assert n > 3
+
+    mats = [render.make_matrix(p, vers) for p in parts]
+    expect = [{(y, x) for y, row in enumerate(m) for x, b in enumerate(row) if b} for m in mats]
+
+    if not numpy:
+        monkeypatch.setattr(render, 'np', None)
+    svg = render.make_animated_svg(parts, vers, scale=3, frame_delay=300).decode('utf-8')
+
+    paths = re.findall(r'<path([^>]*) d="([^"]*)"', svg)
+    common = svg_modules(paths[0][1], 5)
+    frames = [svg_modules(d, 5) for attrs, d in paths if 'class="f"' in attrs]
+    assert len(frames) == n
+
+    # finder patterns are shared
+    assert {(0, 0), (6, 6), (0, len(mats[0])-1)} <= common
+    for i, f in enumerate(frames):
+        assert not (f & common)
+        assert f | common == expect[i]
+
+    assert f'animation:bbqr-f {300*n}ms' in svg
+    assert f'steps({n})' in svg
+    assert f'animation-delay:{300*(n-1)}ms' in svg
+    assert svg.count('<path') == n + 3
+
+    # smaller than the separate files
+    assert len(svg) < sum(len(s) for s in render.render_svgs(parts, vers))
+
+    # just one: no animation
+    one = render.make_animated_svg(parts[0:1], vers).decode('utf-8')
+    assert 'animation' not in one
+    assert svg_modules(re.search(r' d="([^"]*)"', one).group(1), 5) == expect[0]
+
+# EOF
@@ -0,0 +1,78 @@
+#
+# (c) Copyright 2023 by Coinkite Inc. This file is in the public domain.
+#
+
+from context import bbqr
+import pytest, os, json, threading
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+from bbqr.server import BBQrServer
+
+@pytest.fixture(scope='module')
+def server():
+    srv = BBQrServer(('127.0.0.1', 0), jobs=1, max_concurrent=4)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{srv.server_address[1]}'
+    srv.shutdown()
+    srv.server_close()
+
+def call(url, data=None, method=None):
+    try:
+        with urlopen(Request(url, data=data, method=method)) as resp:
+            return resp.status, dict(resp.headers), resp.read()
+    except HTTPError as exc:
+        return exc.code, dict(exc.headers), exc.read()
+
+def test_split_join(server):
+    raw = os.urandom(3000)
+
+    st, _, body = call(server + '/split?type=B&max_version=10', raw)
+    assert st == 200
+    parts = body.decode('ascii').split()
+    assert bbqr.join_qrs(parts) == ('B', raw)
+
+    st, _, body = call(server + '/split?type=B&max_version=10&format=json', raw)
+    assert json.loads(body)['parts'] == parts
+
+    st, _, body = call(server + '/join/s1', '\n'.join(parts[0:2]).encode())
+    assert st == 202
+    assert json.loads(body)['missing'] == list(range(2, len(parts)))
+
+    st, hdrs, body = call(server + '/join/s1', '\n'.join(parts[1:]).encode())
+    assert st == 200
+    assert hdrs['X-BBQr-File-Type'] == 'B'
+    assert body == raw
+
+    st, _, body = call(server + '/split?type=B&format=gif', raw)
+    assert st == 200 and body[0:3] == b'GIF'
+
+    # whole animation in one SVG, or just one part
+    st, hdrs, body = call(server + '/split?type=B&max_version=10&format=svg', raw)
+    assert st == 200 and hdrs['Content-Type'] == 'image/svg+xml'
+    assert body.count(b'class="f"') == len(parts)
+    st, _, body = call(server + '/split?type=B&max_version=10&format=svg&part=1', raw)
+    assert b'animation' not in body
+
+def test_detect_type(server):
+    # no type= given: found from contents
+    import glob
+    fn = glob.glob(os.path.join(os.path.dirname(__file__), '..', '..', 'test_data', '*.psbt'))[0]
+    psbt = open(fn, 'rb').read()
+
+    st, _, body = call(server + '/split', psbt)
+    assert st == 200
+    assert bbqr.join_qrs(body.decode('ascii').split()) == ('P', psbt)
+
+def test_errors(server):
+    assert call(server + '/join/s2', b'garbage')[0] == 400
+    assert call(server + '/split?type=Q', b'data')[0] == 400
+    assert call(server + '/nowhere')[0] == 404
+    assert call(server + '/join/zz', method='DELETE')[0] == 404
+
+    st, _, body = call(server + '/stats')
+    stats = json.loads(body)
+    assert stats['in_flight'] == 0
+    hist = stats['latency']['routes']['join']
+    assert hist['count'] == sum(hist['counts']) >= 1
+
+# EOF